@@ -1,16 +1,31 @@
-import base64
+import copy
+import functools
+import hashlib
 import io
-import sys
+import itertools
+import queue
+import re
+import time
 import uuid
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
 from pathlib import Path
-from threading import Thread, Lock, Timer
+from threading import BoundedSemaphore, Thread, Lock, Timer
 
+import numpy as np
+import torch
 from PIL import Image
-from data.base_dataset import get_params, get_transform
-from flask import Flask, request, jsonify, send_from_directory
-from models import create_model, BaseModel
+from data.base_dataset import get_params, get_preprocessor, images_to_tensor
+from flask import Flask, Response, request, jsonify, send_from_directory
+from job_queue import Job, JobQueue, COMPLETED, FAILED, PROCESSING, WAITING
+from model_registry import ModelRegistry
+from pipeline import Stage
+from result_cache import ResultCache, cache_key
+from models import create_model, networks, onnx_runtime, tiling, BaseModel
 from options.test_options import TestOptions
+from options.dataclass_options import make_options
 from util import util
 import os
 import json
@@ -39,77 +54,379 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='frontend/static', static_url_path='/matgen-ai')
 
-job_results = {}
-job_lock = Lock()
-job_progress = {}
+stats_lock = Lock()
 
 MAX_QUEUE_SIZE = 50
 JOB_TIMEOUT = 120  # seconds
 
-# Replace queue with a list
-job_queue = []
+# Worker pool: INFERENCE_WORKERS threads, or processes that each load their own models.
+# The CPU cores are split evenly between the workers for torch's intra-op parallelism.
+INFERENCE_WORKERS = int(os.environ.get('MATGEN_WORKERS', 1))
+WORKER_MODE = os.environ.get('MATGEN_WORKER_MODE', 'thread')  # thread | process | shard | pipeline
+# In shard mode, every map model runs in MAP_REPLICAS processes of its own and INFERENCE_WORKERS
+# dispatcher threads feed them; the cores are split evenly between all map processes.
+MAP_REPLICAS = int(os.environ.get('MATGEN_MAP_REPLICAS', 1))
+# In pipeline mode, batches flow through bounded stages of threads (preprocess, one stage per model, postprocess,
+# encode) that hold at most PIPELINE_DEPTH waiting batches each; the cores are split evenly between the models.
+# Every dispatcher thread keeps one batch in flight, so INFERENCE_WORKERS > 1 overlaps the stages across jobs.
+PIPELINE_DEPTH = int(os.environ.get('MATGEN_PIPELINE_DEPTH', 2))
+PIPELINE_THREADS = int(os.environ.get('MATGEN_PIPELINE_THREADS', 2))  # threads of the preprocess and postprocess stages
+
+# Micro-batching: the worker stacks up to MAX_BATCH_SIZE queued images into one forward pass,
+# waiting at most MAX_BATCH_WAIT seconds for the batch to fill up
+MAX_BATCH_SIZE = int(os.environ.get('MATGEN_MAX_BATCH_SIZE', 4))
+MAX_BATCH_WAIT = float(os.environ.get('MATGEN_MAX_BATCH_WAIT', 0.05))
+
+# Result cache: a memory tier of CACHE_MAX_BYTES and, if CACHE_DISK_BYTES > 0, a disk tier in CACHE_DIR
+CACHE_MAX_BYTES = int(os.environ.get('MATGEN_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+CACHE_DIR = os.environ.get('MATGEN_CACHE_DIR', '/var/lib/matgen_ai/cache')
+CACHE_DISK_BYTES = int(os.environ.get('MATGEN_CACHE_DISK_BYTES', 0))
+
+CHECKPOINTS_DIR = Path(__file__).parent / "checkpoints"
+
+# Every open result stream holds a server thread; keepalives detect clients that went away. At most MAX_STREAMS
+# streams are open at once, so the other threads stay free for uploads, status polls and map downloads.
+SERVER_THREADS = int(os.environ.get('MATGEN_SERVER_THREADS', 16))
+MAX_STREAMS = int(os.environ.get('MATGEN_MAX_STREAMS', SERVER_THREADS // 2))
+STREAM_KEEPALIVE = 15  # seconds
+
+# Maps are kept as encoded bytes and served from /matgen-ai/api/result/<job_id>/<map name>;
+# a finished job and its maps are removed JOB_TIMEOUT seconds after completion.
+# OUTPUT_FORMAT is png | webp | webp_lossless; the maps in PNG16_MAPS are always written as 16-bit PNG.
+OUTPUT_FORMAT = os.environ.get('MATGEN_OUTPUT_FORMAT', 'png')
+PNG_COMPRESS_LEVEL = int(os.environ.get('MATGEN_PNG_COMPRESS_LEVEL', 6))
+WEBP_QUALITY = int(os.environ.get('MATGEN_WEBP_QUALITY', 90))
+PNG16_MAPS = [name for name in os.environ.get('MATGEN_PNG16_MAPS', '').split(',') if name]
+ENCODE_THREADS = int(os.environ.get('MATGEN_ENCODE_THREADS', 4))
+ENCODING_ID = f"{OUTPUT_FORMAT}:{PNG_COMPRESS_LEVEL}:{WEBP_QUALITY}:{','.join(PNG16_MAPS)}"
+
+# Models are loaded on first use and kept while they fit in MODEL_BUDGET_BYTES (0: no limit); models that have
+# not been used for MODEL_IDLE_TIMEOUT seconds (0: never) are unloaded. Uploads may select a checkpoint
+# version (the epoch label of <version>_net_G.pth); MODEL_VERSION is the default. MATGEN_PRELOAD=1 loads the
+# default models at startup.
+MODEL_BUDGET_BYTES = int(os.environ.get('MATGEN_MODEL_BUDGET_BYTES', 0))
+MODEL_IDLE_TIMEOUT = float(os.environ.get('MATGEN_MODEL_IDLE_TIMEOUT', 0))
+MODEL_VERSION = os.environ.get('MATGEN_MODEL_VERSION', 'latest')
+PRELOAD_MODELS = os.environ.get('MATGEN_PRELOAD', '0') == '1'
+
+MAP_NAMES = ["Albedo", "Normal", "Height", "Roughness", "Metallic"]
+# Serve all maps from the single texgen_p2p_multihead checkpoint (--netG unet_256_multihead)
+MULTIHEAD = os.environ.get('MATGEN_MULTIHEAD', '0') == '1'
+# Run the single-map generators with the flat U-Net forward pass (--netG unet_256_flat), which writes the skip
+# connections into preallocated buffers instead of concatenating them; it loads the same checkpoints. The buffers stay
+# allocated with the model, for MAX_BATCH_SIZE (or TILE_BATCH) inputs, and count towards MODEL_BUDGET_BYTES.
+FLAT_UNET = os.environ.get('MATGEN_FLAT_UNET', '0') == '1'
+# Load the separate map generators as one fused network (networks.fuse_unet_generators): every layer runs once with
+# the filters of all maps, as a grouped convolution. The fused outputs are compared with the separate ones at load time.
+FUSED = os.environ.get('MATGEN_FUSED', '0') == '1'
+# Load the generators exported by pix2pix/export.py (scripts/export_texgen.sh) instead of building the full models. They run
+# in the mode they were exported in (export.py --eval), so the other MATGEN_* settings of the eager generators do not apply.
+TORCHSCRIPT = os.environ.get('MATGEN_TORCHSCRIPT', '0') == '1'
+CHECKPOINT_SUFFIX = "_net_G.torchscript.pt" if TORCHSCRIPT else "_net_G.pth"
+# Run the generators of ONNX_MAPS (comma separated model names, or "all") with ONNX Runtime's CPU provider instead, from the
+# graphs exported by pix2pix/export.py --export_format onnx (scripts/export_texgen_onnx.sh). ONNX_THREADS threads run
+# every operator; 0 uses the torch thread count of the worker. The graphs run in the mode they were exported in (export.py
+# --eval), so the other MATGEN_* settings of the eager generators do not apply to them.
+ONNX_MAPS = [name for name in os.environ.get('MATGEN_ONNX_MAPS', '').split(',') if name]
+ONNX_THREADS = int(os.environ.get('MATGEN_ONNX_THREADS', 0))
+# Run the generators in eval mode (running BatchNorm statistics, no dropout) with BatchNorm folded into the convolutions.
+# This changes the generated maps, so cached results of the two modes are kept apart.
+EVAL_MODE = os.environ.get('MATGEN_EVAL', '0') == '1'
+# Reduced-precision inference: none | int8 (needs MATGEN_EVAL=1) | bf16. The images in QUANTIZE_CALIB_DIR calibrate
+# INT8 and measure the accuracy of every map against float32; see /matgen-ai/api/quantization.
+QUANTIZE = os.environ.get('MATGEN_QUANTIZE', 'none')
+QUANTIZE_CALIB_DIR = os.environ.get('MATGEN_QUANTIZE_CALIB_DIR', str(Path(__file__).parent / "samples"))
+# Fast eager inference: channels_last weights and inputs, and/or generators compiled with torch.compile (see
+# pix2pix/models/compilation.py). Compiling happens when a model is loaded, for batches of 1024x1024 images; other
+# sizes (previews, tiles) are compiled when they first occur. Compiled kernels are kept in COMPILE_CACHE_DIR.
+CHANNELS_LAST = os.environ.get('MATGEN_CHANNELS_LAST', '0') == '1'
+COMPILE = os.environ.get('MATGEN_COMPILE', '0') == '1'
+COMPILE_CACHE_DIR = os.environ.get('MATGEN_COMPILE_CACHE_DIR', '/var/lib/matgen_ai/compile_cache')
+# Tiled inference: if TILE_SIZE > 0, uploads keep their resolution (up to TILE_MAX_SIDE) instead of being resized
+# to 1024x1024, and the generators run over TILE_BATCH tiles of TILE_SIZE at a time that overlap by TILE_OVERLAP.
+# TILE_SIZE must be a multiple of 256 for the unet_256 generators.
+TILE_SIZE = int(os.environ.get('MATGEN_TILE_SIZE', 0))
+TILE_OVERLAP = int(os.environ.get('MATGEN_TILE_OVERLAP', 128))
+TILE_BATCH = int(os.environ.get('MATGEN_TILE_BATCH', 2))
+TILE_MAX_SIDE = int(os.environ.get('MATGEN_TILE_MAX_SIDE', 4096))
+# Progressive results: if PREVIEW_SIZE > 0, every batch first runs at PREVIEW_SIZE x PREVIEW_SIZE (a multiple of 256)
+# and the previews are served from /matgen-ai/api/preview/<job_id>/<map name> until the full-resolution maps replace them
+PREVIEW_SIZE = int(os.environ.get('MATGEN_PREVIEW_SIZE', 0))
+# Generate tileable maps: the generators pad circularly (--seamless) and tiled inference wraps around the borders
+SEAMLESS = os.environ.get('MATGEN_SEAMLESS', '0') == '1'
+
+job_queue = JobQueue(MAX_QUEUE_SIZE)
+stream_slots = BoundedSemaphore(MAX_STREAMS)  # released when the response of a stream is closed
+# worker processes re-import this module but never touch the cache, so only the server opens the disk tier
+result_cache = ResultCache(CACHE_MAX_BYTES, CACHE_DIR, CACHE_DISK_BYTES if multiprocessing.parent_process() is None else 0)
+
+quantization_report = {}  # version -> map name -> accuracy
 
 def update_stats():
-    stats['total_images_inferred'] += 1
-    current_time = datetime.now()
-    stats['last_inference_time'] = current_time.isoformat()
-
-    date_str = current_time.strftime('%Y-%m-%d')
-    stats['inference_count_by_date'][date_str] = stats['inference_count_by_date'].get(date_str, 0) + 1
-
-    with open(STATS_FILE, 'w') as f:
-        json.dump(stats, f, indent=2)
-
-
-def get_model(map_type: str):
-    # Get the directory of the current Python file
-    current_dir = Path(__file__).parent
-
-    # Set the checkpoints_dir relative to the current file
-    checkpoints_dir = current_dir / "checkpoints"
-
-    sys.argv = [
-        sys.argv[0],
-        "--dataroot", "../../texgen/datasets",
-        "--name", f"texgen_p2p_{map_type}",
-        "--model", "pix2pix",
-        "--checkpoints_dir", str(checkpoints_dir),
-        "--batch_size", "2",
-        "--load_size", "1024",
-        "--crop_size", "1024",
-        "--gpu_ids", "-1",
-    ]
-
-    opt = TestOptions().parse()
-    opt.num_threads = 0
-    opt.batch_size = 1
-    opt.serial_batches = True
-    opt.no_flip = True
-    opt.display_id = -1
+    with stats_lock:
+        stats['total_images_inferred'] += 1
+        current_time = datetime.now()
+        stats['last_inference_time'] = current_time.isoformat()
 
+        date_str = current_time.strftime('%Y-%m-%d')
+        stats['inference_count_by_date'][date_str] = stats['inference_count_by_date'].get(date_str, 0) + 1
+
+        with open(STATS_FILE, 'w') as f:
+            json.dump(stats, f, indent=2)
+
+
+def checkpoint_names():
+    """Names of the checkpoints that the models are loaded from"""
+    return ["multihead"] if MULTIHEAD else MAP_NAMES
+
+def model_names():
+    """Names of the models that generate the maps"""
+    return ["fused"] if FUSED else checkpoint_names()
+
+def uses_onnx(name):
+    return "all" in ONNX_MAPS or name in ONNX_MAPS
+
+def checkpoint_path(name, version):
+    suffix = "_net_G.onnx" if uses_onnx(name) else CHECKPOINT_SUFFIX
+    return CHECKPOINTS_DIR / f"texgen_p2p_{name}" / f"{version}{suffix}"
+
+def model_identity(version=MODEL_VERSION):
+    """Identify the checkpoints that produce the maps, to tell cached results of different models apart"""
+    parts = []
+    for name in checkpoint_names():
+        path = checkpoint_path(name, version)
+        if path.exists():
+            st = path.stat()
+            parts.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        else:
+            parts.append(f"{path}:missing")
+        # BaseModel.load_networks prefers the memory-mappable conversion of a .pth checkpoint (convert_checkpoints.py)
+        mmap_path = path.with_name(f"{version}_net_G.mmap.pth")
+        if path.name.endswith("_net_G.pth") and mmap_path.exists():
+            st = mmap_path.stat()
+            parts.append(f"{mmap_path}:{st.st_size}:{st.st_mtime_ns}")
+    if EVAL_MODE:
+        parts.append("eval")
+    if QUANTIZE != "none":
+        parts.append(QUANTIZE)
+    if SEAMLESS:
+        parts.append("seamless")
+    if FUSED:
+        parts.append("fused")
+    if TILE_SIZE > 0:
+        parts.append(f"tiles:{TILE_SIZE}:{TILE_OVERLAP}:{TILE_MAX_SIDE}")
+    return ";".join(parts)
+
+def get_options(map_type: str, netG: str = "unet_256", version: str = MODEL_VERSION):
+    # built once per configuration and copied, without parsing sys.argv, so worker threads can call this
+    return make_options(
+        TestOptions,
+        dataroot="../../texgen/datasets",
+        name=f"texgen_p2p_{map_type}",
+        model="pix2pix",
+        netG=netG,
+        map_names=",".join(MAP_NAMES),
+        checkpoints_dir=str(CHECKPOINTS_DIR),
+        batch_size=1,
+        load_size=1024,
+        crop_size=1024,
+        gpu_ids="-1",
+        epoch=version,
+        quantize=QUANTIZE,
+        calib_dir=QUANTIZE_CALIB_DIR,
+        seamless=SEAMLESS,
+        channels_last=CHANNELS_LAST,
+        compile=COMPILE,
+        compile_cache_dir=COMPILE_CACHE_DIR,
+        num_threads=0,
+        serial_batches=True,
+        no_flip=True,
+    )
+
+class GeneratorModel:
+    """A generator that is called directly on preprocessed inputs, with the options needed to preprocess them"""
+
+    def __call__(self, A):
+        with torch.no_grad():
+            return self.netG(A)
+
+class ScriptedModel(GeneratorModel):
+    """An exported TorchScript generator"""
+
+    def __init__(self, opt):
+        self.opt = opt
+        self.map_names = opt.map_names.split(',') if opt.netG.endswith('_multihead') else []
+        path = CHECKPOINTS_DIR / opt.name / f"{opt.epoch}{CHECKPOINT_SUFFIX}"
+        self.netG = torch.jit.load(str(path), map_location="cpu")
+        self.nbytes = path.stat().st_size  # a frozen module keeps its weights as constants, outside of its state_dict
+
+class OnnxModel(GeneratorModel):
+    """An exported ONNX generator, run by ONNX Runtime"""
+
+    def __init__(self, opt):
+        self.opt = opt
+        self.map_names = opt.map_names.split(',') if opt.netG.endswith('_multihead') else []
+        path = CHECKPOINTS_DIR / opt.name / f"{opt.epoch}_net_G.onnx"
+        self.netG = onnx_runtime.OnnxGenerator(str(path), ONNX_THREADS or torch.get_num_threads())
+
+class FusedModel(GeneratorModel):
+    """The generators of all map models fused into one network"""
+
+    def __init__(self, models):
+        self.opt = models[0].opt
+        self.map_names = list(MAP_NAMES)
+        check_input = torch.rand(1, self.opt.input_nc, 256, 256) * 2 - 1
+        self.netG = networks.fuse_unet_generators([model.netG for model in models], check_input=check_input)
+
+def get_model(map_type: str, netG: str = "unet_256", version: str = MODEL_VERSION):
+    opt = get_options(map_type, netG, version)
+    if uses_onnx(map_type):
+        return OnnxModel(opt), opt
+    if TORCHSCRIPT:
+        # exported generators are frozen with per-sample normalization
+        return ScriptedModel(opt), opt
     model = create_model(opt)
     model.setup(opt)
+    if EVAL_MODE:
+        model.eval()
+        check_input = torch.rand(1, opt.input_nc, 256, 256) * 2 - 1
+        error = networks.fold_batch_norm(model.netG, check_input=check_input)
+        logger.info(f"Folded BatchNorm of {opt.name}, max output difference {error:.2e}")
+    elif MAX_BATCH_SIZE > 1 or TILE_SIZE > 0:
+        # batch statistics must not mix the images of a batch
+        networks.convert_to_per_sample_norm(model.netG)
+    if QUANTIZE != "none":
+        report = model.quantize()["G"]
+        # a single-map model reports its only output under the name of its map
+        quantization_report.setdefault(version, {}).update(report if MULTIHEAD else {map_type: report["output"]})
+        logger.info(f"Quantized {opt.name} to {QUANTIZE}: {report}")
+    if CHANNELS_LAST or COMPILE:
+        start = time.perf_counter()
+        model.compile()
+        logger.info(f"Prepared {opt.name} for fast inference in {time.perf_counter() - start:.1f}s")
     return model, opt
 
-def infere(model: BaseModel, opt: TestOptions, src_im):
-    A = src_im
-    transform_params = get_params(opt, A.size)
-    A_transform = get_transform(opt, transform_params, grayscale=False)
-    B_transform = A
+def preprocess(opt: TestOptions, src_ims, size=None):
+    # every image is resized to load_size x load_size (or size x size), so the batch can be stacked
+    if size is not None:
+        opt = copy.copy(opt)
+        opt.load_size = opt.crop_size = size
+    return get_preprocessor(opt).batch(src_ims, [get_params(opt, im.size) for im in src_ims])
 
-    A = A_transform(A)
-    A = A.unsqueeze(0)
+def infere_tensor(model: BaseModel, A):
+    if isinstance(model, GeneratorModel):
+        return model(A)
     B = A
 
     data = {'A': A, 'B': B, 'A_paths': "AB_path", 'B_paths': "AB_path"}
 
+    model.set_input(data)
+    model.test()
+    return model.get_current_visuals()['fake_B']
+
+def run_generator(model: BaseModel, A):
+    """Return the raw generator output for a preprocessed batch; the maps of a multi-head generator are stacked"""
+    if isinstance(model, GeneratorModel):
+        return model(A)
+    with torch.inference_mode() if model.inference_mode else torch.no_grad():
+        return model.netG(A.to(model.device)).cpu()
+
+def preprocess_native(im, max_side=TILE_MAX_SIDE):
+    """Convert an image to a 1x3xHxW input tensor at its own resolution, downscaled to at most <max_side>"""
+    if max(im.size) > max_side:
+        im = im.copy()
+        im.thumbnail((max_side, max_side), Image.BICUBIC)
+    return images_to_tensor([im])
+
+def infere_tiled(model: BaseModel, inputs):
+    """Run the generator tile by tile on every input of preprocess_native; return one 1xCxHxW output per input"""
+    return [tiling.tiled_forward(lambda tiles: run_generator(model, tiles), A, TILE_SIZE, TILE_OVERLAP, TILE_BATCH, wrap=SEAMLESS)
+            for A in inputs]
+
+def infere_multihead(model: BaseModel, A):
+    opt = model.opt
+    if isinstance(model, GeneratorModel):
+        return dict(zip(model.map_names, model(A).split(opt.output_nc, dim=1)))
+    # B is only split into visuals; give it the stacked shape of all maps without allocating it
+    B = A.new_zeros(()).expand(A.size(0), opt.output_nc * len(model.map_names), *A.shape[2:])
+
+    data = {'A': A, 'B': B, 'A_paths': "AB_path", 'B_paths': "AB_path"}
+
     model.set_input(data)
     model.test()
     visuals = model.get_current_visuals()
 
-    items = visuals.items()
-    im = util.tensor2im(list(items)[1][1])
-    return im
+    return {name: visuals['fake_B_' + name] for name in model.map_names}
+
+def load_model(key):
+    """Load the model for a (name, version) key of the model registry"""
+    name, version = key
+    if name == "fused":
+        return FusedModel([get_model(map_name, version=version)[0] for map_name in MAP_NAMES])
+    netG = "unet_256_multihead" if name == "multihead" else "unet_256_flat" if FLAT_UNET else "unet_256"
+    model, _ = get_model(name, netG, version)
+    if isinstance(model.netG, networks.FlatUnetGenerator):
+        # the concatenation buffers are allocated once, for the largest batch that is served
+        model.netG.max_batch_size = TILE_BATCH if TILE_SIZE > 0 else MAX_BATCH_SIZE
+    return model
+
+def model_bytes(model):
+    """Memory held by the parameters and buffers of a model's generator, and by the buffers of a flat U-Net forward pass"""
+    if isinstance(model, OnnxModel):
+        return model.netG.nbytes
+    if isinstance(model, ScriptedModel):
+        return model.nbytes
+    state_dict = model.netG.state_dict()
+    nbytes = sum(t.numel() * t.element_size() for t in state_dict.values() if isinstance(t, torch.Tensor))
+    if isinstance(model.netG, networks.FlatUnetGenerator):
+        # the arena is still empty at load time; count it at its size for the largest inputs
+        size = TILE_SIZE if TILE_SIZE > 0 else max(model.opt.crop_size, PREVIEW_SIZE)
+        nbytes += model.netG.arena_nbytes(model.netG.max_batch_size, size, size)
+    return nbytes
+
+registry = ModelRegistry(load_model, model_bytes, MODEL_BUDGET_BYTES, MODEL_IDLE_TIMEOUT)
+
+def preload_models():
+    for name in model_names():
+        with registry.use((name, MODEL_VERSION)):
+            pass
+
+def prepare_inputs(images, size=None, version=MODEL_VERSION):
+    """Preprocess a batch of images once for all map models
+
+    Returns one NxCxHxW tensor of images resized to <size> x <size> (or to the size of the model options), or, with
+    tiled inference and no <size>, one 1xCxHxW tensor per image at its own resolution.
+    """
+    if TILE_SIZE > 0 and size is None:
+        # the images keep their own sizes, so they are not stacked
+        return [preprocess_native(im) for im in images]
+    # all map models share the preprocessing options
+    return preprocess(get_options(MAP_NAMES[0], version=version), images, size)
+
+def run_model(model: BaseModel, name, inputs):
+    """Run one model on the inputs of prepare_inputs; return its (map name, outputs) pairs (see generate_maps)"""
+    if isinstance(inputs, list):
+        outputs = infere_tiled(model, inputs)
+        if MULTIHEAD or FUSED:
+            nc = model.opt.output_nc
+            return [(map_name, [output[:, i * nc:(i + 1) * nc] for output in outputs]) for i, map_name in enumerate(model.map_names)]
+        return [(name, outputs)]
+    if MULTIHEAD or FUSED:
+        return list(infere_multihead(model, inputs).items())
+    return [(name, infere_tensor(model, inputs))]
+
+def generate_maps(images, size=None, version=MODEL_VERSION):
+    """Yield (map name, outputs) for every map of a batch of input images
+
+    The images are resized to <size> x <size> if given, and to the size of the model options otherwise; the outputs
+    are then one NxCxHxW tensor. Tiled images keep their own sizes, and the outputs are one 1xCxHxW tensor per image.
+    The images are preprocessed once for all models; the models of checkpoint <version> are loaded if needed.
+    """
+    inputs = prepare_inputs(images, size, version)
+    for name in model_names():
+        with registry.use((name, version)) as model:
+            maps = run_model(model, name, inputs)
+        yield from maps
 
 @app.route('/matgen-ai/')
 def index():
@@ -124,119 +441,585 @@ def serve_js():
     return send_from_directory(app.static_folder, 'script.js')
 
 def cleanup_job(job_id):
-    with job_lock:
-        if job_id in job_results:
-            del job_results[job_id]
-        if job_id in job_progress:
-            del job_progress[job_id]
+    job_queue.remove(job_id)
     logger.info(f"Cleaned up job {job_id}")
 
-def inference_worker():
-    global job_queue
-    while True:
-        if len(job_queue) > 0:
-            job_id, image = job_queue.pop(0)
+class EncodeTimings:
+    """Count, time and size of the encoded maps, per output format"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.totals = {}
+
+    def add(self, fmt, seconds, size):
+        with self.lock:
+            count, total_seconds, total_bytes = self.totals.get(fmt, (0, 0.0, 0))
+            self.totals[fmt] = (count + 1, total_seconds + seconds, total_bytes + size)
+
+    def summary(self):
+        with self.lock:
+            return {fmt: {"count": count, "mean_ms": total_seconds / count * 1000, "mean_bytes": total_bytes / count}
+                    for fmt, (count, total_seconds, total_bytes) in self.totals.items()}
+
+encode_timings = EncodeTimings()
+encode_pool = ThreadPoolExecutor(ENCODE_THREADS, thread_name_prefix="encode")
+
+def result_format(name):
+    return "png16" if name in PNG16_MAPS else OUTPUT_FORMAT
+
+def result_mimetype(name):
+    return "image/webp" if result_format(name).startswith("webp") else "image/png"
+
+def postprocess(name, outputs):
+    """Convert the outputs of one map (see generate_maps) into HxWx3 arrays of the bit depth of its format"""
+    imtype = np.uint16 if result_format(name) == "png16" else np.uint8
+    if isinstance(outputs, torch.Tensor):
+        return list(util.tensors2im(outputs, imtype))
+    return [util.tensors2im(output, imtype)[0] for output in outputs]
+
+def encode_map(name, image):
+    """Encode one generated map (an HxWx3 array from postprocess) in the format configured for it"""
+    start = time.perf_counter()
+    fmt = result_format(name)
+    if fmt == "png16":
+        data = util.encode_png16(image, PNG_COMPRESS_LEVEL)
+    else:
+        pil_image = Image.fromarray(image)
+        buffer = io.BytesIO()
+        if fmt == "webp":
+            pil_image.save(buffer, format="WEBP", quality=WEBP_QUALITY)
+        elif fmt == "webp_lossless":
+            pil_image.save(buffer, format="WEBP", lossless=True)
         else:
-            import time
-            time.sleep(1)  # Wait for 1 second if the queue is empty
-            continue
+            pil_image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        data = buffer.getvalue()
+    encode_timings.add(fmt, time.perf_counter() - start, len(data))
+    return data
 
-        if job_id is None:
-            break
+def run_batch(images, on_map, size=None, version=MODEL_VERSION):
+    """Generate and encode all maps for a batch of images; return one {map name: encoded map} dict per image
+
+    Every map is encoded on the encode pool while the next map is generated. <on_map>(name, encoded maps)
+    is called, in generation order, as soon as a map is encoded for the whole batch.
+    """
+    results = [{} for _ in images]
+    pending = deque()
 
-        logger.info(f"Processing job {job_id}")
-        results = {}
-        for i, (name, model) in enumerate(models.items()):
-            im = infere(model, model.opt, image)
-            pil_image = Image.fromarray(im)
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format="PNG")
-            encoded_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            results[name] = encoded_image
+    def report(block):
+        while pending and (block or all(future.done() for future in pending[0][1])):
+            name, futures = pending.popleft()
+            encoded_images = [future.result() for future in futures]
+            for result, encoded_image in zip(results, encoded_images):
+                result[name] = encoded_image
+            on_map(name, encoded_images)
 
-            # Update progress
-            with job_lock:
-                job_progress[job_id] = (i + 1) / len(models) * 100
+    for name, outputs in generate_maps(images, size, version):
+        pending.append((name, [encode_pool.submit(encode_map, name, image) for image in postprocess(name, outputs)]))
+        report(block=False)
+    report(block=True)
+    return results
 
-        with job_lock:
-            job_results[job_id] = results
-            job_progress[job_id] = 100
+def process_batch(jobs, run):
+    logger.info(f"Processing batch of {len(jobs)}: {', '.join(job.id for job in jobs)}")
 
-        logger.info(f"Completed job {job_id}")
+    if PREVIEW_SIZE > 0:
+        def on_preview(name, encoded_images):
+            for job, encoded_image in zip(jobs, encoded_images):
+                job_queue.add_preview(job, name, encoded_image)
+
+        try:
+            run([job.image for job in jobs], on_preview, size=PREVIEW_SIZE, version=jobs[0].model_version)
+        except Exception:
+            # the full-resolution pass below still produces the maps
+            logger.exception(f"Previews of batch of {len(jobs)} failed")
+
+    n_done = 0
+
+    def on_map(name, encoded_images):
+        nonlocal n_done
+        n_done += 1
+        for job, encoded_image in zip(jobs, encoded_images):
+            job_queue.add_map(job, name, encoded_image, n_done / len(MAP_NAMES) * 100)
+
+    try:
+        results = run([job.image for job in jobs], on_map, version=jobs[0].model_version)
+    except Exception:
+        logger.exception(f"Batch of {len(jobs)} failed")
+        for job in jobs:
+            job_queue.fail(job)
+            Timer(JOB_TIMEOUT, cleanup_job, args=[job.id]).start()
+        return
+
+    for job, result in zip(jobs, results):
+        result_cache.put(job.key, result)
+        if not job_queue.finish(job, result):
+            continue
+        logger.info(f"Completed job {job.id}")
 
         # Update statistics
         update_stats()
 
         # Set a timer to clean up the job after timeout
-        Timer(JOB_TIMEOUT, cleanup_job, args=[job_id]).start()
+        Timer(JOB_TIMEOUT, cleanup_job, args=[job.id]).start()
+
+def inference_worker(run=run_batch):
+    while True:
+        jobs = job_queue.get_batch(MAX_BATCH_SIZE, MAX_BATCH_WAIT)
+        if not jobs:
+            break
+        # a batch runs through one set of models
+        by_version = {}
+        for job in jobs:
+            by_version.setdefault(job.model_version, []).append(job)
+        for version_jobs in by_version.values():
+            process_batch(version_jobs, run)
+
+def process_worker(conn, num_threads):
+    """Entry point of a worker process: run the batches received over <conn> with its own model registry"""
+    torch.set_num_threads(num_threads)
+    if PRELOAD_MODELS:
+        preload_models()
+    while True:
+        message = conn.recv()
+        if message is None:
+            logger.info(f"Encoding timings: {encode_timings.summary()}")
+            break
+        images, size, version = message
+        try:
+            results = run_batch(images, lambda name, encoded_images: conn.send(("map", (name, encoded_images))), size, version)
+        except Exception as e:
+            conn.send(("error", repr(e)))
+        else:
+            conn.send(("done", results))
+
+def process_dispatcher(num_threads):
+    """Feed batches from the job queue to one worker process"""
+    context = multiprocessing.get_context("spawn")
+    conn, child_conn = context.Pipe()
+    process = context.Process(target=process_worker, args=(child_conn, num_threads), daemon=True)
+    process.start()
+
+    def run(images, on_map, size=None, version=MODEL_VERSION):
+        conn.send((images, size, version))
+        while True:
+            kind, payload = conn.recv()
+            if kind == "map":
+                on_map(*payload)
+            elif kind == "done":
+                return payload
+            else:
+                raise RuntimeError(f"Worker process failed: {payload}")
+
+    try:
+        inference_worker(run)
+    finally:
+        conn.send(None)
+        process.join()
+
+def shard_worker(map_type, tasks, results, num_threads):
+    """Entry point of a map process: load one map model and run it on the shared input tensors from <tasks>"""
+    torch.set_num_threads(num_threads)
+    model = load_model((map_type, MODEL_VERSION))  # the same generator variant as in the other worker modes
+    while True:
+        task = tasks.get()
+        if task is None:
+            logger.info(f"{map_type} encoding timings: {encode_timings.summary()}")
+            break
+        batch_id, A = task
+        try:
+            output = infere_tensor(model, A)
+            encoded = [encode_map(map_type, image) for image in postprocess(map_type, output)]
+        except Exception as e:
+            results.put((batch_id, map_type, RuntimeError(f"{map_type} process failed: {e!r}")))
+        else:
+            results.put((batch_id, map_type, encoded))
+
+class MapShards:
+    """Run every map model in its own process(es), so the maps of one batch are computed concurrently
+
+    The input batch is preprocessed once in the server process and handed to the map processes as a
+    shared-memory tensor. MAP_REPLICAS processes per map pull from the same task queue, so several
+    batches can be in flight when more than one dispatcher thread feeds the shards.
+    """
+
+    def __init__(self, num_threads):
+        context = torch.multiprocessing.get_context("spawn")
+        self.opt = get_options(MAP_NAMES[0])  # all map models share the same preprocessing options
+        self.tasks = {name: context.Queue() for name in MAP_NAMES}
+        self.results = context.Queue()
+        self.processes = [context.Process(target=shard_worker, args=(name, self.tasks[name], self.results, num_threads), daemon=True)
+                          for name in MAP_NAMES for _ in range(MAP_REPLICAS)]
+        self.pending = {}
+        self.pending_lock = Lock()
+        self.batch_ids = itertools.count()
+        self.collector = Thread(target=self.collect, daemon=True)
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        self.collector.start()
+
+    def collect(self):
+        """Route the results of the map processes to the batches waiting for them"""
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            batch_id, name, payload = item
+            with self.pending_lock:
+                done = self.pending.get(batch_id)
+            if done is not None:  # the batch may already have failed because of another map
+                done.put((name, payload))
+
+    def run(self, images, on_map, size=None, version=MODEL_VERSION):
+        # every map process holds the model of MODEL_VERSION only; uploads cannot select another version
+        A = preprocess(self.opt, images, size).share_memory_()
+        batch_id = next(self.batch_ids)
+        done = queue.Queue()
+        with self.pending_lock:
+            self.pending[batch_id] = done
+        try:
+            for tasks in self.tasks.values():
+                tasks.put((batch_id, A))
+
+            results = [{} for _ in images]
+            for _ in MAP_NAMES:
+                name, payload = done.get()
+                if isinstance(payload, Exception):
+                    raise payload
+                for result, encoded_image in zip(results, payload):
+                    result[name] = encoded_image
+                on_map(name, payload)
+        finally:
+            with self.pending_lock:
+                del self.pending[batch_id]
+        # maps arrive in completion order
+        return [{name: result[name] for name in MAP_NAMES} for result in results]
+
+    def close(self):
+        for tasks in self.tasks.values():
+            for _ in range(MAP_REPLICAS):
+                tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
+        self.collector.join()
+
+class PipelineBatch:
+    """A batch of images on its way through the stages of a StagePipeline"""
+
+    def __init__(self, images, size, version):
+        self.images = images
+        self.size = size
+        self.version = version
+        self.inputs = None
+        self.done = queue.Queue()  # (map name, encoded maps) once a map is encoded for the whole batch, or (None, exception)
+        self.failed = False
+        self.lock = Lock()
+        self.encoded = {}  # map name -> encoded maps, None where not encoded yet
+        self.missing = {}  # map name -> number of maps not encoded yet
+
+    def fail(self, e):
+        with self.lock:
+            if self.failed:
+                return
+            self.failed = True
+        self.done.put((None, e))
+
+    def add_encoded(self, name, i, data):
+        with self.lock:
+            self.encoded[name][i] = data
+            self.missing[name] -= 1
+            complete = self.missing[name] == 0
+        if complete:
+            self.done.put((name, self.encoded[name]))
+
+class StagePipeline:
+    """Run batches through bounded stages: preprocess once -> one stage per model -> postprocess -> encode
+
+    Every stage has threads of its own, so while one batch is encoded, the models can run the next batch and
+    the one after that is preprocessed. The images are decoded by the upload handler, and every batch is
+    preprocessed once for all models. Each model runs in a single thread, as the registry lets it run one batch at a time.
+    """
+
+    def __init__(self):
+        self.encode = Stage("encode", self._encode, ENCODE_THREADS, PIPELINE_DEPTH * MAX_BATCH_SIZE, self._fail)
+        self.postprocess = Stage("postprocess", self._postprocess, PIPELINE_THREADS, PIPELINE_DEPTH, self._fail)
+        self.models = {name: Stage(f"model-{name}", functools.partial(self._run_model, name), 1, PIPELINE_DEPTH, self._fail)
+                       for name in model_names()}
+        self.preprocess = Stage("preprocess", self._preprocess, PIPELINE_THREADS, PIPELINE_DEPTH, self._fail)
+
+    @staticmethod
+    def _fail(item, e):
+        batch = item if isinstance(item, PipelineBatch) else item[0]
+        batch.fail(e)
+
+    def _preprocess(self, batch):
+        batch.inputs = prepare_inputs(batch.images, batch.size, batch.version)
+        for stage in self.models.values():
+            stage.put(batch)
+
+    def _run_model(self, name, batch):
+        if batch.failed:
+            return
+        with registry.use((name, batch.version)) as model:
+            maps = run_model(model, name, batch.inputs)
+        for map_name, outputs in maps:
+            self.postprocess.put((batch, map_name, outputs))
+
+    def _postprocess(self, item):
+        batch, name, outputs = item
+        if batch.failed:
+            return
+        images = postprocess(name, outputs)
+        with batch.lock:
+            batch.encoded[name] = [None] * len(images)
+            batch.missing[name] = len(images)
+        for i, image in enumerate(images):
+            self.encode.put((batch, name, i, image))
+
+    def _encode(self, item):
+        batch, name, i, image = item
+        if batch.failed:
+            return
+        batch.add_encoded(name, i, encode_map(name, image))
+
+    def run(self, images, on_map, size=None, version=MODEL_VERSION):
+        batch = PipelineBatch(images, size, version)
+        self.preprocess.put(batch)
+        results = [{} for _ in images]
+        for _ in MAP_NAMES:
+            name, payload = batch.done.get()
+            if isinstance(payload, Exception):
+                raise payload
+            for result, encoded_image in zip(results, payload):
+                result[name] = encoded_image
+            on_map(name, payload)
+        # maps arrive in completion order
+        return [{name: result[name] for name in MAP_NAMES} for result in results]
+
+    def close(self):
+        # upstream stages first, so every stage has drained its inputs before it stops
+        for stage in [self.preprocess, *self.models.values(), self.postprocess, self.encode]:
+            stage.close()
 
 @app.route('/matgen-ai/api/upload', methods=['POST'])
 def upload_image():
-    if len(job_queue) >= MAX_QUEUE_SIZE:
-        logger.warning(f"Job queue full. Current size: {len(job_queue)}")
-        return jsonify({"error": "Server is too busy. Please try again later."}), 503
-
     if 'image' not in request.files:
         return jsonify({"error": "No image provided"}), 400
 
     image = request.files['image']
+    version = request.form.get('version', MODEL_VERSION)
+    if not re.fullmatch(r"[\w.-]+", version) or not all(checkpoint_path(name, version).exists() for name in checkpoint_names()):
+        return jsonify({"error": f"Unknown model version {version}"}), 400
+    if WORKER_MODE == "shard" and version != MODEL_VERSION:
+        return jsonify({"error": "Only the default model version is available"}), 400
+
     img = Image.open(io.BytesIO(image.read())).convert('RGB')
     job_id = str(uuid.uuid4())
+    key = cache_key(img, f"{model_identity(version)};{ENCODING_ID}")
 
-    with job_lock:
-        job_progress[job_id] = 0
+    result = result_cache.get(key)
+    if result is not None:
+        job_queue.add_completed(Job(job_id, None, key, version), result)
+        Timer(JOB_TIMEOUT, cleanup_job, args=[job_id]).start()
+        logger.info(f"Served job {job_id} from cache")
+        return jsonify({"job_id": job_id}), 202
 
-    job_queue.append((job_id, img))
+    if not job_queue.put(Job(job_id, img, key, version)):
+        logger.warning(f"Job queue full. Current size: {len(job_queue)}")
+        return jsonify({"error": "Server is too busy. Please try again later."}), 503
     logger.info(f"Added job {job_id} to queue. Current queue size: {len(job_queue)}")
 
     return jsonify({"job_id": job_id}), 202
 
 @app.route('/matgen-ai/api/status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
-    with job_lock:
-        if job_id in job_results:
-            progress = job_progress.pop(job_id, 100)
-            result = job_results.pop(job_id)  # Remove the result after sending
-            logger.info(f"Job {job_id} completed and result sent")
-            return jsonify({"status": "completed", "progress": progress, "result": result}), 200
-        elif job_id in job_progress:
-            return jsonify({"status": "processing", "progress": job_progress[job_id]}), 200
-
-    queue_position = next((i for i, job in enumerate(job_queue) if job[0] == job_id), -1)
-    if queue_position != -1:
-        logger.info(f"Job {job_id} waiting in queue at position {queue_position}")
-        return jsonify({"status": "waiting", "queue_position": queue_position}), 200
-
-    logger.warning(f"Job {job_id} not found")
-    return jsonify({"status": "not found"}), 404
+    job = job_queue.get(job_id)
+    if job is None:
+        logger.warning(f"Job {job_id} not found")
+        return jsonify({"status": "not found"}), 404
+
+    if job.state == COMPLETED:
+        logger.info(f"Job {job_id} completed and result sent")
+        result = {name: result_url(job_id, name) for name in job.result}
+        return jsonify({"status": "completed", "progress": job.progress, "result": result}), 200
+    elif job.state == FAILED:
+        job_queue.remove(job_id)
+        return jsonify({"status": "failed", "error": "Inference failed."}), 500
+    elif job.state == PROCESSING:
+        # full-resolution maps so far, and the previews of the maps that are still being refined
+        result = {name: result_url(job_id, name) for name in job.result}
+        previews = {name: preview_url(job_id, name) for name in job.previews if name not in job.result}
+        return jsonify({"status": "processing", "progress": job.progress, "stage": job.stage, "result": result, "previews": previews}), 200
+
+    queue_position = job_queue.position(job_id)
+    logger.info(f"Job {job_id} waiting in queue at position {queue_position}")
+    return jsonify({"status": "waiting", "queue_position": queue_position}), 200
+
+@app.route('/matgen-ai/api/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify(result_cache.stats()), 200
+
+def result_url(job_id, name):
+    return f"/matgen-ai/api/result/{job_id}/{name}"
+
+def preview_url(job_id, name):
+    return f"/matgen-ai/api/preview/{job_id}/{name}"
+
+@app.route('/matgen-ai/api/result/<job_id>/<name>', methods=['GET'])
+def get_result_map(job_id, name):
+    """Serve one encoded map; available as soon as it is generated and until the job is cleaned up"""
+    job = job_queue.get(job_id)
+    return serve_map(job_id, name, job.result.get(name) if job is not None else None)
+
+@app.route('/matgen-ai/api/preview/<job_id>/<name>', methods=['GET'])
+def get_preview_map(job_id, name):
+    """Serve the preview of one map; available until the job completes"""
+    job = job_queue.get(job_id)
+    return serve_map(job_id, name, job.previews.get(name) if job is not None else None)
+
+def serve_map(job_id, name, data):
+    if data is None:
+        logger.warning(f"Map {name} of job {job_id} not found")
+        return jsonify({"status": "not found"}), 404
+
+    response = Response(data, mimetype=result_mimetype(name))
+    response.set_etag(hashlib.sha1(data).hexdigest())
+    response.cache_control.private = True
+    response.cache_control.max_age = JOB_TIMEOUT
+    return response.make_conditional(request)
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/matgen-ai/api/stream/<job_id>', methods=['GET'])
+def stream_job(job_id):
+    """Server-Sent Events: the job status, then every preview and map as soon as it is generated"""
+    job = job_queue.get(job_id)
+    if job is None:
+        logger.warning(f"Job {job_id} not found")
+        return jsonify({"status": "not found"}), 404
+    if not stream_slots.acquire(blocking=False):
+        # the client falls back to polling /matgen-ai/api/status
+        return jsonify({"status": "too many streams"}), 503
+
+    def events():
+        sent = set()
+        sent_previews = set()
+        version = -1
+        position = None
+        while True:
+            new_version, state, progress, result, previews, new_position = job_queue.wait_for_update(
+                job, version, STREAM_KEEPALIVE, position)
+            if new_version == version and new_position == position:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            position = new_position
+
+            for name in previews:
+                if name not in sent_previews and name not in result:
+                    sent_previews.add(name)
+                    yield sse("preview", {"name": name, "url": preview_url(job_id, name)})
+
+            for name in result:
+                if name not in sent:
+                    sent.add(name)
+                    yield sse("map", {"name": name, "url": result_url(job_id, name), "progress": progress})
+
+            if state == WAITING:
+                yield sse("status", {"status": "waiting", "queue_position": position})
+            elif state == PROCESSING:
+                yield sse("status", {"status": "processing", "progress": progress})
+            elif state == COMPLETED:
+                logger.info(f"Job {job_id} completed and result streamed")
+                yield sse("done", {"status": "completed"})
+                return
+            else:
+                job_queue.remove(job_id)
+                yield sse("failed", {"status": state, "error": "Inference failed." if state == FAILED else "Job cancelled."})
+                return
+
+    response = Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(stream_slots.release)
+    return response
+
+@app.route('/matgen-ai/api/encoding', methods=['GET'])
+def get_encoding_stats():
+    """Encoding timings of this process; in process and shard mode the workers log theirs"""
+    return jsonify(encode_timings.summary()), 200
+
+@app.route('/matgen-ai/api/models', methods=['GET'])
+def get_model_stats():
+    """Models loaded in this process; in process mode every worker has its own registry"""
+    return jsonify(registry.stats()), 200
+
+@app.route('/matgen-ai/api/quantization', methods=['GET'])
+def get_quantization_report():
+    """Accuracy of the quantized maps against float32; in process and shard mode the workers log theirs"""
+    return jsonify(quantization_report), 200
 
 @app.route('/matgen-ai/api/cancel/<job_id>', methods=['POST'])
 def cancel_job(job_id):
-    global job_queue
-    with job_lock:
-        if job_id in job_progress:
-            del job_progress[job_id]
-        if job_id in job_results:
-            del job_results[job_id]
-
-    # Remove the job from the queue if it's still there
-    job_queue = [job for job in job_queue if job[0] != job_id]
+    job_queue.cancel(job_id)
     logger.info(f"Cancelled job {job_id}")
 
     return jsonify({"status": "cancelled"}), 200
 
 if __name__ == '__main__':
-    # Load all models
-    models = {}
-    for name in ["Albedo", "Normal", "Height", "Roughness", "Metallic"]:
-        models[name], _ = get_model(name)
-    inference_thread = Thread(target=inference_worker, daemon=True)
-    inference_thread.start()
+    num_threads = max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS)
+    shards = None
+    pipeline = None
+    if FUSED and (MULTIHEAD or TORCHSCRIPT or ONNX_MAPS or QUANTIZE != "none" or CHANNELS_LAST or COMPILE):
+        raise SystemExit("MATGEN_FUSED fuses the float32 eager map generators; it cannot be combined with MATGEN_MULTIHEAD, MATGEN_TORCHSCRIPT, "
+                         "MATGEN_ONNX_MAPS, MATGEN_QUANTIZE, MATGEN_CHANNELS_LAST or MATGEN_COMPILE")
+    if TILE_SIZE < 0 or TILE_SIZE % 256:
+        raise SystemExit("MATGEN_TILE_SIZE must be a multiple of 256, the stride of the unet_256 generators (or 0 to disable tiling)")
+    if TILE_SIZE > 0 and not (0 <= TILE_OVERLAP < TILE_SIZE and TILE_BATCH >= 1):
+        raise SystemExit("MATGEN_TILE_OVERLAP must be at least 0 and smaller than MATGEN_TILE_SIZE, and MATGEN_TILE_BATCH at least 1")
+    if QUANTIZE == "int8" and not EVAL_MODE:
+        raise SystemExit("MATGEN_QUANTIZE=int8 calibrates the eval-mode generators with folded BatchNorm; it needs MATGEN_EVAL=1")
+    if TORCHSCRIPT and (EVAL_MODE or QUANTIZE != "none" or CHANNELS_LAST or COMPILE or FLAT_UNET):
+        raise SystemExit("MATGEN_TORCHSCRIPT runs the modules as exported, in the mode chosen by export.py --eval; it cannot be combined "
+                         "with MATGEN_EVAL, MATGEN_QUANTIZE, MATGEN_CHANNELS_LAST, MATGEN_COMPILE or MATGEN_FLAT_UNET")
+    if ONNX_MAPS and (EVAL_MODE or QUANTIZE != "none" or CHANNELS_LAST or COMPILE or FLAT_UNET):
+        raise SystemExit("MATGEN_ONNX_MAPS runs the graphs as exported, in the mode chosen by export.py --eval; it cannot be combined "
+                         "with MATGEN_EVAL, MATGEN_QUANTIZE, MATGEN_CHANNELS_LAST, MATGEN_COMPILE or MATGEN_FLAT_UNET")
+    if WORKER_MODE == "shard":
+        if MULTIHEAD or FUSED:
+            raise SystemExit("MATGEN_WORKER_MODE=shard needs one model per map; it cannot be combined with MATGEN_MULTIHEAD or MATGEN_FUSED")
+        if TILE_SIZE > 0:
+            raise SystemExit("MATGEN_WORKER_MODE=shard shares one stacked input batch; it cannot be combined with MATGEN_TILE_SIZE")
+        shards = MapShards(max(1, (os.cpu_count() or 1) // (len(MAP_NAMES) * MAP_REPLICAS)))
+        shards.start()
+        workers = [Thread(target=inference_worker, args=(shards.run,), daemon=True) for _ in range(INFERENCE_WORKERS)]
+    elif WORKER_MODE == "pipeline":
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // len(model_names())))
+        if PRELOAD_MODELS:
+            preload_models()
+        pipeline = StagePipeline()
+        workers = [Thread(target=inference_worker, args=(pipeline.run,), daemon=True) for _ in range(INFERENCE_WORKERS)]
+    elif WORKER_MODE == "process":
+        workers = [Thread(target=process_dispatcher, args=(num_threads,), daemon=True) for _ in range(INFERENCE_WORKERS)]
+    else:
+        # The worker threads share the models of the registry, but each model runs one batch at a time
+        torch.set_num_threads(num_threads)
+        if PRELOAD_MODELS:
+            preload_models()
+        workers = [Thread(target=inference_worker, daemon=True) for _ in range(INFERENCE_WORKERS)]
+    for worker in workers:
+        worker.start()
 
     logger.info("Server started")
     try:
-        serve(app, host="127.0.0.1", port=8001)
+        serve(app, host="127.0.0.1", port=8001, threads=SERVER_THREADS)
     finally:
-        job_queue.append((None, None))
-        inference_thread.join()
+        job_queue.close()
+        for worker in workers:
+            worker.join()
+        if shards is not None:
+            shards.close()
+        if pipeline is not None:
+            pipeline.close()
         logger.info("Server stopped")
@@ -0,0 +1,205 @@
+"""Latency benchmark of the backend pipeline, stage by stage.
+
+Runs the functions of backend.py on JPEG-encoded inputs, the sample image samples/stones.jpg and a synthetic
+noise image, for every combination of --sizes, --batch_sizes and --threads, and times the stages
+
+    decode      -- JPEG bytes to RGB images, as in the upload handler
+    preprocess  -- resize and normalize into one input batch for all models (backend.prepare_inputs)
+    forward     -- the generators of all maps (backend.run_generator)
+    postprocess -- the outputs to uint8/uint16 arrays (backend.postprocess)
+    encode      -- the arrays to PNG/WebP (backend.encode_map), one image after the other
+    end_to_end  -- decode and backend.run_batch, which overlaps generation and encoding on the encode pool
+
+The backend is configured with the same MATGEN_* environment variables as the server, e.g.
+
+    PYTHONPATH=pix2pix MATGEN_EVAL=1 python benchmark.py --sizes 256,1024 --batch_sizes 1,4 --save baseline.json
+    PYTHONPATH=pix2pix MATGEN_EVAL=1 python benchmark.py --sizes 256,1024 --batch_sizes 1,4 --compare baseline.json
+
+Every stage reports p50/p95/p99 and the mean latency per batch in milliseconds and its throughput in images per second.
+--save stores the results as JSON; --compare reports the p50 of every stage against such a baseline and exits with
+status 1 if any stage got slower by more than --tolerance.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+import backend
+
+STAGES = ["decode", "preprocess", "forward", "postprocess", "encode", "end_to_end"]
+
+
+def percentile(values, q):
+    """Return the <q>-th percentile of <values>, linearly interpolated between the closest ranks"""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(seconds, batch_size):
+    mean = sum(seconds) / len(seconds)
+    return {
+        "p50_ms": percentile(seconds, 50) * 1000,
+        "p95_ms": percentile(seconds, 95) * 1000,
+        "p99_ms": percentile(seconds, 99) * 1000,
+        "mean_ms": mean * 1000,
+        "images_per_s": batch_size / mean if mean > 0 else float("inf"),
+    }
+
+
+def input_images(size, sample):
+    """Return {input name: JPEG bytes} of the sample image and a synthetic noise image of <size> x <size>"""
+    images = {"synthetic": Image.fromarray(np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8))}
+    if sample.exists():
+        images[sample.stem] = Image.open(sample).convert("RGB").resize((size, size), Image.BICUBIC)
+    inputs = {}
+    for name, image in images.items():
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=95)
+        inputs[name] = buffer.getvalue()
+    return inputs
+
+
+def split_maps(model, name, output):
+    """Return (map name, output) pairs of one generator output; a multi-head or fused output stacks all maps"""
+    if name not in ("multihead", "fused"):
+        return [(name, output)]
+    return list(zip(model.map_names, output.split(model.opt.output_nc, dim=1)))
+
+
+def run_stages(data, batch_size, size, version):
+    """Run the stages once on <batch_size> copies of the JPEG <data>; return {stage: seconds}"""
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    start = time.perf_counter()
+    images = [Image.open(io.BytesIO(data)).convert("RGB") for _ in range(batch_size)]
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    A = backend.prepare_inputs(images, size, version)
+    timings["preprocess"] = time.perf_counter() - start
+
+    for name in backend.model_names():
+        with backend.registry.use((name, version)) as model:
+            start = time.perf_counter()
+            output = backend.run_generator(model, A)
+            timings["forward"] += time.perf_counter() - start
+
+            for map_name, map_output in split_maps(model, name, output):
+                start = time.perf_counter()
+                arrays = backend.postprocess(map_name, map_output)
+                timings["postprocess"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                for array in arrays:
+                    backend.encode_map(map_name, array)
+                timings["encode"] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    images = [Image.open(io.BytesIO(data)).convert("RGB") for _ in range(batch_size)]
+    backend.run_batch(images, lambda name, encoded_images: None, size, version)
+    timings["end_to_end"] = time.perf_counter() - start
+    return timings
+
+
+def benchmark(args):
+    results = {}
+    sample = Path(args.sample)
+    for size in args.sizes:
+        inputs = input_images(size, sample)
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for batch_size in args.batch_sizes:
+                for input_name, data in inputs.items():
+                    for _ in range(args.warmup):
+                        run_stages(data, batch_size, size, args.version)
+                    runs = [run_stages(data, batch_size, size, args.version) for _ in range(args.iterations)]
+                    config = f"{input_name}/{size}px/batch{batch_size}/threads{threads}"
+                    results[config] = {stage: summarize([run[stage] for run in runs], batch_size) for stage in STAGES}
+                    print(format_config(config, results[config]), flush=True)
+    return results
+
+
+def format_config(config, stages):
+    lines = [config]
+    for stage, summary in stages.items():
+        lines.append(f"  {stage:<12} p50 {summary['p50_ms']:9.1f} ms  p95 {summary['p95_ms']:9.1f} ms  "
+                     f"p99 {summary['p99_ms']:9.1f} ms  {summary['images_per_s']:8.2f} img/s")
+    return "\n".join(lines)
+
+
+def compare(results, baseline, tolerance):
+    """Print the p50 of every stage relative to <baseline>; return the list of regressions"""
+    regressions = []
+    for config, stages in results.items():
+        if config not in baseline:
+            continue
+        for stage, summary in stages.items():
+            reference = baseline[config].get(stage)
+            if reference is None or reference["p50_ms"] <= 0:
+                continue
+            ratio = summary["p50_ms"] / reference["p50_ms"]
+            marker = ""
+            if ratio > 1 + tolerance:
+                marker = "  REGRESSION"
+                regressions.append((config, stage, ratio))
+            print(f"{config} {stage:<12} {reference['p50_ms']:9.1f} -> {summary['p50_ms']:9.1f} ms  x{ratio:.2f}{marker}")
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "models": backend.model_identity(),
+        "encoding": backend.ENCODING_ID,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0], formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--sizes", type=str, default="256,512,1024", help="input and inference sizes, comma separated; multiples of 256")
+    parser.add_argument("--batch_sizes", type=str, default="1,4", help="batch sizes, comma separated")
+    parser.add_argument("--threads", type=str, default=str(torch.get_num_threads()), help="torch intra-op thread counts, comma separated")
+    parser.add_argument("--iterations", type=int, default=10, help="timed runs per configuration")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per configuration")
+    parser.add_argument("--sample", type=str, default=str(Path(__file__).parent / "samples" / "stones.jpg"), help="sample image")
+    parser.add_argument("--version", type=str, default=backend.MODEL_VERSION, help="checkpoint version of the models")
+    parser.add_argument("--save", type=str, default="", help="write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default="", help="compare the results with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative p50 slowdown reported as a regression")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.batch_sizes = [int(batch_size) for batch_size in args.batch_sizes.split(",")]
+    args.threads = [int(threads) for threads in args.threads.split(",")]
+    if backend.TILE_SIZE > 0:
+        print("MATGEN_TILE_SIZE is ignored: the benchmark runs every input at a fixed size", file=sys.stderr)
+
+    results = benchmark(args)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
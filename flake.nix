@@ -45,7 +45,7 @@
 
           installPhase = ''
             mkdir -p $out/bin
-            cp -r backend.py $out/
+            cp -r backend.py job_queue.py model_registry.py pipeline.py result_cache.py $out/
             cp -r frontend $out/
             cp -r ${weights}/ $out/checkpoints
             echo "#!/bin/sh" > $out/bin/matgen-ai
@@ -1,6 +1,8 @@
 let currentJobId = null;
+let currentStream = null;
 let scene, camera, renderer, cube;
 let textures = {};
+let displayedUrls = {};
 let isDragging = false;
 let previousMousePosition = {
     x: 0,
@@ -86,8 +88,8 @@ function onMouseMove(event) {
 function updatePreview(results) {
     const textureLoader = new THREE.TextureLoader();
 
-    for (const [mapType, imageData] of Object.entries(results)) {
-        const texture = textureLoader.load('data:image/png;base64,' + imageData);
+    for (const [mapType, url] of Object.entries(results)) {
+        const texture = textureLoader.load(url);
         textures[mapType] = texture;
     }
 
@@ -226,7 +228,11 @@ function uploadImage() {
         }
         currentJobId = data.job_id;
         showOverlay();
-        checkStatus(data.job_id);
+        if (window.EventSource) {
+            streamStatus(data.job_id);
+        } else {
+            checkStatus(data.job_id);
+        }
     })
     .catch(error => {
         console.error('Error:', error);
@@ -234,14 +240,67 @@ function uploadImage() {
     });
 }
 
+function streamStatus(jobId) {
+    const source = new EventSource(`/matgen-ai/api/stream/${jobId}`);
+    currentStream = source;
+
+    source.addEventListener('status', (event) => {
+        updateOverlay(JSON.parse(event.data));
+    });
+    source.addEventListener('preview', (event) => {
+        // a low-resolution map; the full-resolution map replaces it later
+        const data = JSON.parse(event.data);
+        displayResults({ [data.name]: data.url });
+        updateOverlay({ status: 'processing', stage: 'preview', progress: 0 });
+    });
+    source.addEventListener('map', (event) => {
+        const data = JSON.parse(event.data);
+        displayResults({ [data.name]: data.url });
+        updateOverlay({ status: 'processing', stage: 'full', progress: data.progress });
+    });
+    source.addEventListener('done', () => {
+        closeStream();
+        hideOverlay();
+    });
+    source.addEventListener('failed', (event) => {
+        closeStream();
+        hideOverlay();
+        currentJobId = null;
+        alert(JSON.parse(event.data).error);
+    });
+    source.onerror = () => {
+        // The stream broke off; fall back to polling
+        closeStream();
+        checkStatus(jobId);
+    };
+}
+
+function closeStream() {
+    if (currentStream) {
+        currentStream.close();
+        currentStream = null;
+    }
+}
+
 function checkStatus(jobId) {
     fetch(`/matgen-ai/api/status/${jobId}`)
     .then(response => response.json())
     .then(data => {
+        if (jobId !== currentJobId) {
+            return;  // the job was cancelled
+        }
         updateOverlay(data);
         if (data.status === 'completed') {
             displayResults(data.result);
             hideOverlay();
+        } else if (data.status === 'processing') {
+            displayResults(data.previews);
+            displayResults(data.result);
+            setTimeout(() => checkStatus(jobId), 1000);
+        } else if (data.status === 'failed' || data.status === 'not found') {
+            hideOverlay();
+            currentJobId = null;
+            alert(data.error || 'The job could not be completed.');
         } else {
             setTimeout(() => checkStatus(jobId), 1000);
         }
@@ -257,7 +316,8 @@ function updateOverlay(data) {
     const progressBar = document.getElementById('progress');
 
     if (data.status === 'processing') {
-        overlayStatus.textContent = 'Processing...';
+        overlayStatus.textContent = data.stage === 'preview' ? 'Generating previews...' :
+            data.stage === 'full' ? 'Refining...' : 'Processing...';
         progressBar.style.width = `${data.progress}%`;
     } else if (data.status === 'waiting') {
         overlayStatus.textContent = 'Waiting for resources to become available...';
@@ -274,6 +334,7 @@ function hideOverlay() {
 }
 
 function cancelJob() {
+    closeStream();
     if (currentJobId) {
         fetch(`/matgen-ai/api/cancel/${currentJobId}`, { method: 'POST' })
         .then(response => response.json())
@@ -334,15 +395,21 @@ function saveTextures() {
 }
 
 function displayResults(results) {
+    // polling reports the same maps again; only load new ones
+    results = Object.fromEntries(Object.entries(results).filter(([mapType, url]) => displayedUrls[mapType] !== url));
+    if (!Object.keys(results).length) {
+        return;
+    }
+    Object.assign(displayedUrls, results);
     updatePreview(results);
 
     const textureControls = document.getElementById('texture-controls');
     const texturePreviews = textureControls.getElementsByClassName('texture-preview');
 
-    for (const [mapType, imageData] of Object.entries(results)) {
+    for (const [mapType, url] of Object.entries(results)) {
         const img = textureControls.querySelector(`[data-type="${mapType}"]`);
         if (img) {
-            img.src = `data:image/png;base64,${imageData}`;
+            img.src = url;
             img.classList.remove('placeholder');
             img.classList.add('active');
         }
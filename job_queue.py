@@ -0,0 +1,211 @@
+"""Bounded, blocking job queue for the inference workers.
+
+Every upload becomes a <Job> that moves through the states
+
+    waiting -> processing -> completed | failed
+
+and can be cancelled from any state before it completes. Workers block in <JobQueue.get_batch>
+instead of polling, and cancelling a waiting job only marks it (a tombstone); the workers skip
+tombstones when they pop jobs, so cancel is O(1). Maps are added to a job's result one by one as
+they are generated, optionally preceded by low-resolution previews, and <JobQueue.wait_for_update>
+lets a client follow a job without polling.
+"""
+import time
+from collections import deque
+from threading import Condition, Lock
+
+WAITING = 'waiting'
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job:
+    """One upload, its progress and its result"""
+
+    def __init__(self, job_id, image, key=None, model_version=None):
+        self.id = job_id
+        self.image = image
+        self.key = key  # content hash of the input, used to cache the result
+        self.model_version = model_version  # checkpoint version of the models that process the job
+        self.state = WAITING
+        self.progress = 0
+        self.result = {}
+        self.previews = {}  # low-resolution maps, replaced by the result when the job completes
+        self.stage = None   # 'preview' while previews are added, 'full' once full-resolution maps are added
+        self.version = 0  # incremented on every change
+
+
+class JobQueue:
+    """A FIFO of waiting jobs plus a registry of all jobs that have not been removed yet"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._cond = Condition(self._lock)     # notified when a job is put
+        self._updated = Condition(self._lock)  # notified when any job changes
+        self._waiting = deque()  # may contain cancelled jobs, which are skipped when popping
+        self._n_waiting = 0
+        self._jobs = {}
+        self._closed = False
+
+    def __len__(self):
+        """Return the number of waiting (not cancelled) jobs"""
+        return self._n_waiting
+
+    def put(self, job):
+        """Add a job; return False if the queue is full or closed"""
+        with self._cond:
+            if self._closed or self._n_waiting >= self.maxsize:
+                return False
+            self._jobs[job.id] = job
+            self._waiting.append(job)
+            self._n_waiting += 1
+            self._cond.notify()
+            return True
+
+    def _touch(self, job):
+        """Record a change of <job>; the lock must be held"""
+        job.version += 1
+        self._updated.notify_all()
+
+    def _pop(self):
+        """Return the oldest waiting job marked as processing, or None; the lock must be held"""
+        while self._waiting:
+            job = self._waiting.popleft()
+            if job.state == WAITING:
+                self._n_waiting -= 1
+                job.state = PROCESSING
+                self._touch(job)
+                return job
+        return None
+
+    def add_completed(self, job, result):
+        """Register a job whose result is already known, e.g. from a cache"""
+        with self._cond:
+            job.image = None
+            job.state = COMPLETED
+            job.progress = 100
+            job.result = result
+            job.stage = 'full'
+            self._jobs[job.id] = job
+            self._touch(job)
+
+    def get_batch(self, max_size=1, max_wait=0.0):
+        """Block until a job is waiting, then collect up to <max_size> jobs for at most <max_wait> seconds
+
+        Returns an empty list once the queue is closed and drained.
+        """
+        with self._cond:
+            job = self._pop()
+            while job is None and not self._closed:
+                self._cond.wait()
+                job = self._pop()
+            if job is None:
+                return []
+
+            batch = [job]
+            deadline = time.monotonic() + max_wait
+            while len(batch) < max_size:
+                job = self._pop()
+                if job is not None:
+                    batch.append(job)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+            return batch
+
+    def get(self, job_id):
+        """Return the job with the given id, or None"""
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job_id):
+        """Return the number of waiting jobs ahead of the given job, or -1 if it is not waiting"""
+        with self._cond:
+            return self._position(job_id)
+
+    def _position(self, job_id):
+        """See <position>; the lock must be held"""
+        position = 0
+        for job in self._waiting:
+            if job.id == job_id:
+                return position if job.state == WAITING else -1
+            if job.state == WAITING:
+                position += 1
+        return -1
+
+    def wait_for_update(self, job, version, timeout=None, position=None):
+        """Wait until <job> changes after <version>, its queue position changes from <position> or <timeout> seconds pass
+
+        A waiting job moves up whenever a job ahead of it is popped or cancelled, which notifies all waiters too.
+        Returns a snapshot (version, state, progress, result, previews, position) taken under the lock.
+        """
+        with self._cond:
+            self._updated.wait_for(lambda: job.version != version or self._position(job.id) != position, timeout)
+            return job.version, job.state, job.progress, dict(job.result), dict(job.previews), self._position(job.id)
+
+    def add_preview(self, job, name, value):
+        """Add the low-resolution preview of one map to a processing job"""
+        with self._cond:
+            if job.state == PROCESSING:
+                job.previews[name] = value
+                job.stage = 'preview'
+                self._touch(job)
+
+    def add_map(self, job, name, value, progress):
+        """Add one generated map to the result of a processing job"""
+        with self._cond:
+            if job.state == PROCESSING:
+                job.result[name] = value
+                job.progress = progress
+                job.stage = 'full'
+                self._touch(job)
+
+    def finish(self, job, result):
+        """Store the result of a processing job; return False if the job was cancelled meanwhile"""
+        with self._cond:
+            job.image = None
+            if job.state != PROCESSING:
+                return False
+            job.state = COMPLETED
+            job.progress = 100
+            job.result = result
+            job.previews = {}
+            job.stage = 'full'
+            self._touch(job)
+            return True
+
+    def fail(self, job):
+        with self._cond:
+            job.image = None
+            if job.state == PROCESSING:
+                job.state = FAILED
+                self._touch(job)
+
+    def cancel(self, job_id):
+        """Cancel and remove a job; a waiting job stays in the FIFO as a tombstone"""
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return False
+            if job.state == WAITING:
+                self._n_waiting -= 1
+                job.image = None
+            job.state = CANCELLED
+            self._touch(job)
+            return True
+
+    def remove(self, job_id):
+        """Forget a finished job"""
+        with self._cond:
+            return self._jobs.pop(job_id, None)
+
+    def close(self):
+        """Stop accepting jobs and wake up all workers; they exit once the queue is drained"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -1,6 +1,5 @@
 import os
 import pathlib
-import sys
 
 import torch.utils.data
 from PIL import Image
@@ -9,25 +8,24 @@ from data.aligned_dataset import AlignedDataset
 from data.base_dataset import get_params, get_transform
 from models import create_model, BaseModel
 from options.test_options import TestOptions
+from options.dataclass_options import make_options
 from util import util
 
 img_path = pathlib.Path("../samples")
 img_name = "clover"
 
 def get_model(map_type: str) -> (BaseModel, TestOptions):
-    sys.argv = [
-        sys.argv[0],
-        "--dataroot", "../../texgen/datasets",
-        "--name", "texgen_p2p_Albedo",
-        "--model", "pix2pix",
-        "--checkpoints_dir", "checkpoints",
-        "--batch_size", "2",
-        "--load_size", "1024",
-        "--crop_size", "1024",
-        "--gpu_ids", "-1",
-    ]
-
-    opt = TestOptions().parse()  # get test options
+    opt = make_options(
+        TestOptions,
+        dataroot="../../texgen/datasets",
+        name="texgen_p2p_Albedo",
+        model="pix2pix",
+        checkpoints_dir="checkpoints",
+        batch_size=2,
+        load_size=1024,
+        crop_size=1024,
+        gpu_ids="-1",
+    )  # get test options
     # hard-code some parameters for test
     opt.num_threads = 0  # test code only supports num_threads = 0
     opt.batch_size = 1  # test code only supports batch_size = 1
@@ -66,9 +64,7 @@ def infere(model: BaseModel, opt: TestOptions, src_im) -> Image:
     model.test()  # run inference
     visuals = model.get_current_visuals()  # get image results
 
-    items = visuals.items()
-    im = util.tensor2im(list(items)[1][1])
-    return im
+    return util.visuals2im(visuals, ['fake_B'])['fake_B'][0]
 
 
 if __name__ == '__main__':
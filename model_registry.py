@@ -0,0 +1,141 @@
+"""Lazily loaded models in an LRU cache bounded by memory.
+
+A model is identified by a hashable key (e.g. (map name, checkpoint version)) and loaded by a loader
+function the first time it is used, so several versions of a model can be held side by side. While the
+loaded models exceed the memory budget, the least recently used models that are not in use are unloaded;
+models that have not been used for <idle_timeout> seconds are unloaded by a background thread.
+"""
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, model, size):
+        self.model = model
+        self.size = size
+        self.lock = Lock()  # a model keeps its inputs and outputs as attributes, so it runs one batch at a time
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    """Load models on first use and keep them within a memory budget"""
+
+    def __init__(self, loader, sizeof, max_bytes=0, idle_timeout=0):
+        """
+        Parameters:
+            loader (callable)    -- loader(key) returns the model for <key>
+            sizeof (callable)    -- sizeof(model) returns the memory held by a model in bytes
+            max_bytes (int)      -- memory budget of the loaded models; 0 disables it
+            idle_timeout (float) -- unload models that have not been used for this many seconds; 0 disables it
+        """
+        self.loader = loader
+        self.sizeof = sizeof
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.lock = Lock()
+        self.entries = OrderedDict()  # key -> _Entry, least recently used first
+        self.loading = {}             # key -> Lock held while the model is loaded
+        self.bytes = 0
+        self.loads = 0
+        self.unloads = 0
+        self._reaper = None
+
+    @contextmanager
+    def use(self, key):
+        """Yield the model for <key>, loading it if needed; no other thread uses the model meanwhile"""
+        entry = self._acquire(key)
+        try:
+            with entry.lock:
+                yield entry.model
+        finally:
+            with self.lock:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+                self._evict()
+
+    def _acquire(self, key):
+        with self.lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry
+            load_lock = self.loading.setdefault(key, Lock())
+
+        # load outside the registry lock, but only once per key
+        with load_lock:
+            with self.lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    return entry
+            start = time.perf_counter()
+            model = self.loader(key)
+            entry = _Entry(model, self.sizeof(model))
+            entry.users = 1
+            logger.info(f"Loaded model {key} ({entry.size / 2**20:.0f} MiB) in {time.perf_counter() - start:.1f}s")
+            with self.lock:
+                self.entries[key] = entry
+                self.bytes += entry.size
+                self.loads += 1
+                self.loading.pop(key, None)
+                self._evict()
+                self._start_reaper()
+            return entry
+
+    def _lookup(self, key):
+        """Return the entry for <key> marked as used, or None; the lock must be held"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            entry.users += 1
+        return entry
+
+    def _unload(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        self.unloads += 1
+        logger.info(f"Unloaded model {key}")
+
+    def _evict(self):
+        """Unload unused models, least recently used first, until the budget is met; the lock must be held"""
+        if self.max_bytes <= 0:
+            return
+        for key in [key for key, entry in self.entries.items() if entry.users == 0]:
+            if self.bytes <= self.max_bytes:
+                break
+            self._unload(key)
+
+    def unload_idle(self):
+        """Unload the models that have not been used for <idle_timeout> seconds"""
+        with self.lock:
+            now = time.monotonic()
+            for key in [key for key, entry in self.entries.items()
+                        if entry.users == 0 and now - entry.last_used > self.idle_timeout]:
+                self._unload(key)
+
+    def _start_reaper(self):
+        """Start the thread that unloads idle models; the lock must be held"""
+        if self.idle_timeout <= 0 or self._reaper is not None:
+            return
+
+        def reap():
+            while True:
+                time.sleep(self.idle_timeout / 2)
+                self.unload_idle()
+
+        self._reaper = Thread(target=reap, daemon=True)
+        self._reaper.start()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'loaded': [list(key) if isinstance(key, tuple) else key for key in self.entries],
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'loads': self.loads,
+                'unloads': self.unloads,
+            }
@@ -0,0 +1,58 @@
+"""Bounded stages of worker threads for pipelined inference.
+
+A <Stage> is a queue of work items and a pool of threads that apply a function to them. The function hands
+its results on by putting them into the next stage, so a chain of stages works on several items at once,
+each stage on a different one. Every queue is bounded: when a stage falls behind, the stages before it block
+on <Stage.put> instead of piling up work, and the slowest stage sets the pace of the whole chain. Stages
+must form a chain or a tree (no cycles), otherwise two full stages could wait for each other.
+"""
+import logging
+import queue
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """A pool of threads that apply <function> to the items of a bounded queue"""
+
+    def __init__(self, name, function, workers=1, maxsize=0, on_error=None):
+        """
+        Parameters:
+            name (str)          -- used in the names of the threads and in log messages
+            function (callable) -- function(item) processes one item and puts its results into the next stage
+            workers (int)       -- the number of threads
+            maxsize (int)       -- the number of items that may wait in the queue; 0 means unbounded
+            on_error (callable) -- on_error(item, exception) is called when <function> raises; errors are logged if None
+        """
+        self.name = name
+        self.function = function
+        self.on_error = on_error
+        self.queue = queue.Queue(maxsize)
+        self.threads = [Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        """Queue <item>; blocks while the queue is full"""
+        self.queue.put(item)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.function(item)
+            except Exception as e:
+                if self.on_error is None:
+                    logger.exception(f"Stage {self.name} failed")
+                else:
+                    self.on_error(item, e)
+
+    def close(self):
+        """Let the threads finish the queued items and exit"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,27 @@
+"""Convert saved networks to memory-mappable checkpoints for fast loading.
+
+Once you have trained your model with train.py, you can use this script to convert its checkpoints.
+It will load the networks '<epoch>_net_<name>.pth' of a test-time model from '--checkpoints_dir' and save
+them next to the originals as '<epoch>_net_<name>.mmap.pth'.
+
+When a converted checkpoint exists, BaseModel.load_networks memory-maps it instead of reading the original:
+the InstanceNorm patching of old checkpoints was already applied here, and on the CPU the weights are used
+directly from the page cache, so loading does not copy them and processes that load the same checkpoint share
+its memory. Requires PyTorch 2.1 or newer. Delete the converted file (or convert again) after retraining.
+
+Example:
+    Convert the generator of a pix2pix model:
+        python convert_checkpoints.py --dataroot ./datasets/facades --name facades_pix2pix --model pix2pix --direction BtoA
+
+See options/base_options.py and options/test_options.py for more options.
+"""
+from options.test_options import TestOptions
+from models import create_model
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse()  # get test options
+    model = create_model(opt)      # create a model given opt.model and other options
+    model.setup(opt)               # regular setup: load (and patch) the networks
+    load_suffix = 'iter_%d' % opt.load_iter if opt.load_iter > 0 else opt.epoch
+    model.save_mmap_networks(load_suffix)
@@ -1,5 +1,5 @@
 import os
-from data.base_dataset import BaseDataset, get_params, get_transform
+from data.base_dataset import BaseDataset, get_params, get_preprocessor
 from data.image_folder import make_dataset
 from PIL import Image
 
@@ -9,6 +9,8 @@ class AlignedDataset(BaseDataset):
 
     It assumes that the directory '/path/to/data/train' contains image pairs in the form of {A,B}.
     During test time, you need to prepare a directory '/path/to/data/test'.
+    For a *_multihead generator, every image is a strip {A,B_1,...,B_n} with one B panel per map in '--map_names';
+    the B panels are stacked along the channel dimension.
     """
 
     def __init__(self, opt):
@@ -23,6 +25,9 @@ class AlignedDataset(BaseDataset):
         assert(self.opt.load_size >= self.opt.crop_size)   # crop_size should be smaller than the size of loaded image
         self.input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
         self.output_nc = self.opt.input_nc if self.opt.direction == 'BtoA' else self.opt.output_nc
+        self.n_maps = len(opt.map_names.split(',')) if opt.netG.endswith('_multihead') else 1
+        self.A_preprocessor = get_preprocessor(self.opt, grayscale=(self.input_nc == 1))
+        self.B_preprocessor = get_preprocessor(self.opt, grayscale=(self.output_nc == 1))
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
@@ -39,19 +44,16 @@ class AlignedDataset(BaseDataset):
         # read a image given a random integer index
         AB_path = self.AB_paths[index]
         AB = Image.open(AB_path).convert('RGB')
-        # split AB image into A and B
+        # split AB image into A and B (one B panel per map)
         w, h = AB.size
-        w2 = int(w / 2)
+        w2 = int(w / (self.n_maps + 1))
         A = AB.crop((0, 0, w2, h))
-        B = AB.crop((w2, 0, w, h))
+        Bs = [AB.crop((w2 * i, 0, w2 * (i + 1), h)) for i in range(1, self.n_maps)] + [AB.crop((w2 * self.n_maps, 0, w, h))]
 
-        # apply the same transform to both A and B
+        # apply the same transform to both A and B; the B panels are converted as one batch and stacked along channels
         transform_params = get_params(self.opt, A.size)
-        A_transform = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1))
-        B_transform = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1))
-
-        A = A_transform(A)
-        B = B_transform(B)
+        A = self.A_preprocessor(A, transform_params)
+        B = self.B_preprocessor.batch(Bs, [transform_params] * len(Bs)).flatten(0, 1)
 
         return {'A': A, 'B': B, 'A_paths': AB_path, 'B_paths': AB_path}
 
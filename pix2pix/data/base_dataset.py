@@ -1,9 +1,12 @@
 """This module implements an abstract base class (ABC) 'BaseDataset' for datasets.
 
-It also includes common transformation functions (e.g., get_transform, __scale_width), which can be later used in subclasses.
+It also includes common transformation functions (e.g., get_transform, __scale_width), which can be later used in subclasses,
+and <Preprocessor>, a cached form of get_transform that also converts whole batches.
 """
+import functools
 import random
 import numpy as np
+import torch
 import torch.utils.data as data
 from PIL import Image
 import torchvision.transforms as transforms
@@ -112,6 +115,90 @@ def get_transform(opt, params=None, grayscale=False, method=transforms.Interpola
     return transforms.Compose(transform_list)
 
 
+def images_to_tensor(imgs):
+    """Convert equally sized PIL images (RGB or L) to an NxCxHxW tensor in [-1, 1]
+
+    The images are stacked as one uint8 array, and ToTensor and Normalize((0.5, ...), (0.5, ...)) are replaced by
+    one conversion and one multiply-add over the whole batch.
+    """
+    array = np.stack([np.asarray(img) for img in imgs])
+    if array.ndim == 3:  # grayscale images have no channel axis
+        array = array[..., None]
+    batch = torch.empty(array.shape[0], array.shape[3], array.shape[1], array.shape[2])
+    batch.copy_(torch.from_numpy(array).permute(0, 3, 1, 2))
+    return batch.mul_(2 / 255).sub_(1)
+
+
+class Preprocessor:
+    """The transform of <get_transform> as a reusable object that also processes batches
+
+    <get_transform> builds a new Compose of Lambdas for every set of params. A Preprocessor is built once per
+    option set (see <get_preprocessor>) and takes the params of every image when it is called. Images are
+    resized, cropped and flipped with PIL exactly like <get_transform> does; the conversion to a tensor is done
+    for the whole batch at once (see <images_to_tensor>).
+    """
+
+    def __init__(self, preprocess, load_size, crop_size, no_flip, grayscale=False, method=transforms.InterpolationMode.BICUBIC):
+        self.preprocess = preprocess
+        self.load_size = load_size
+        self.crop_size = crop_size
+        self.no_flip = no_flip
+        self.grayscale = grayscale
+        self.method = method
+
+    def transform_image(self, img, params=None):
+        """Apply the geometric part of the transform to a PIL image; random params are drawn if <params> is None"""
+        return _transform_image(self, img, params)
+
+    def batch(self, imgs, params=None):
+        """Transform a list of PIL images with one params dict per image into an NxCxHxW tensor
+
+        All images must have the same size after the transform, e.g. with --preprocess resize_and_crop.
+        """
+        params = params if params is not None else [None] * len(imgs)
+        return images_to_tensor([self.transform_image(img, p) for img, p in zip(imgs, params)])
+
+    def __call__(self, img, params=None):
+        """Transform a PIL image into a CxHxW tensor, like get_transform(opt, params, grayscale)(img)"""
+        return self.batch([img], [params])[0]
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_preprocessor(preprocess, load_size, crop_size, no_flip, grayscale, method):
+    return Preprocessor(preprocess, load_size, crop_size, no_flip, grayscale, method)
+
+
+def get_preprocessor(opt, grayscale=False, method=transforms.InterpolationMode.BICUBIC):
+    """Return the <Preprocessor> for the preprocessing options of <opt>; it is built once per option set"""
+    return _cached_preprocessor(opt.preprocess, opt.load_size, opt.crop_size, opt.no_flip, grayscale, method)
+
+
+def _transform_image(p, img, params):
+    # the steps of get_transform; a module-level function, because the names of the __ helpers would be mangled in a class
+    if p.grayscale:
+        img = img.convert('L')
+    if 'resize' in p.preprocess:
+        img = img.resize((p.load_size, p.load_size), __transforms2pil_resize(p.method))
+    elif 'scale_width' in p.preprocess:
+        img = __scale_width(img, p.load_size, p.crop_size, p.method)
+
+    if 'crop' in p.preprocess:
+        if params is None:
+            img = transforms.RandomCrop(p.crop_size)(img)
+        else:
+            img = __crop(img, params['crop_pos'], p.crop_size)
+
+    if p.preprocess == 'none':
+        img = __make_power_2(img, base=4, method=p.method)
+
+    if not p.no_flip:
+        if params is None:
+            img = transforms.RandomHorizontalFlip()(img)
+        else:
+            img = __flip(img, params['flip'])
+    return img
+
+
 def __transforms2pil_resize(method):
     mapper = {transforms.InterpolationMode.BILINEAR: Image.BILINEAR,
               transforms.InterpolationMode.BICUBIC: Image.BICUBIC,
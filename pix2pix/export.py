@@ -0,0 +1,127 @@
+"""Export a trained generator as a frozen TorchScript module or as an ONNX graph for inference.
+
+Once you have trained your model with train.py, you can use this script to export its generator.
+It will load the saved generator '<epoch>_net_G.pth' from '--checkpoints_dir' and save the exported module
+next to it as '<epoch>_net_G.torchscript.pt'. The module can be loaded without this code base:
+
+    netG = torch.jit.load('<epoch>_net_G.torchscript.pt')
+    fake_B = netG(real_A)  # real_A: Nx<input_nc>xHxW tensor normalized to [-1, 1]
+
+Like test.py, the generator keeps its training-mode behavior (batch statistics in the normalization
+layers and active dropout) unless '--eval' is given. Its BatchNorm layers are converted to per-sample
+normalization first, so a batch of images gives the same result as feeding the images one by one.
+With '--eval', BatchNorm is folded into the preceding convolutions instead (see networks.fold_batch_norm),
+and the export fails if that changes the output.
+
+With '--export_mode trace' (default), the generator is traced on a <crop_size> input. A traced graph records
+the train/eval behavior of the trace, so it is always frozen: the weights become constants. '--export_mode script' keeps the Python control flow,
+but the scripted module is only frozen with '--eval'.
+
+With '--export_format onnx', the generator is written to '<epoch>_net_G.onnx' instead, with dynamic batch and
+image sizes (see models/onnx_runtime.py). If ONNX Runtime is installed, the graph is then run next to the eager
+generator on the <crop_size> input and on a batch of two inputs of another size: the export fails if their outputs
+differ, and the latencies of both are printed side by side. Dropout draws different masks in both, so without '--eval'
+the comparison runs on a copy of the generator without dropout layers, and on a second graph exported from it.
+
+Example:
+    Export the generator of a pix2pix model:
+        python export.py --dataroot ./datasets/facades --name facades_pix2pix --model pix2pix --direction BtoA
+    Export it to ONNX:
+        python export.py --dataroot ./datasets/facades --name facades_pix2pix --model pix2pix --direction BtoA --eval --export_format onnx
+
+See options/base_options.py and options/test_options.py for more options.
+"""
+import copy
+import os
+import torch
+from options.test_options import TestOptions
+from models import create_model, networks, onnx_runtime
+
+
+def export_torchscript(opt, netG, example, save_dir):
+    """Save <netG> as '<epoch>_net_G.torchscript.pt' in <save_dir> and return the path"""
+    with torch.no_grad():
+        if opt.export_mode == 'trace':
+            # dropout makes the outputs of two runs differ, so the trace cannot be checked by rerunning it
+            exported = torch.jit.trace(netG, example, check_trace=False)
+        elif opt.export_mode == 'script':
+            exported = torch.jit.script(netG)
+        else:
+            raise NotImplementedError('export mode [%s] is not recognized' % opt.export_mode)
+
+        if opt.export_mode == 'trace' or opt.eval:
+            # freezing needs an eval-mode module; a traced graph keeps the behavior it was traced with
+            exported = torch.jit.optimize_for_inference(torch.jit.freeze(exported.eval()))
+        exported(example)  # run the optimized graph once, so that errors show up now
+
+    export_path = os.path.join(save_dir, '%s_net_G.torchscript.pt' % opt.epoch)
+    torch.jit.save(exported, export_path)
+    return export_path
+
+
+def without_dropout(net):
+    """Return a copy of <net> whose Dropout layers are replaced by identities, in the same train/eval mode otherwise"""
+    net = copy.deepcopy(net)
+    for module in list(net.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, torch.nn.Dropout):
+                setattr(module, name, networks.Identity())
+    return net
+
+
+def export_onnx(opt, netG, examples, save_dir, tolerance=1e-3):
+    """Save <netG> as '<epoch>_net_G.onnx' in <save_dir>, check it against <netG> on every input of <examples> and return the path"""
+    export_path = os.path.join(save_dir, '%s_net_G.onnx' % opt.epoch)
+    onnx_runtime.export_onnx(netG, examples[0], export_path, opset=opt.onnx_opset)
+
+    # dropout draws different masks in every pass, which would hide differences of the outputs; exporting with it
+    # disabled in place does not help, since a training-mode export switches all modules back to training mode
+    has_dropout = any(isinstance(m, torch.nn.Dropout) and m.training for m in netG.modules())
+    reference = without_dropout(netG) if has_dropout else netG
+    check_path = export_path + '.check' if has_dropout else export_path
+    try:
+        if has_dropout:
+            onnx_runtime.export_onnx(reference, examples[0], check_path, opset=opt.onnx_opset)
+        try:
+            generator = onnx_runtime.OnnxGenerator(check_path)
+        except ImportError:
+            print('onnxruntime is not installed; the exported graph is not checked')
+            return export_path
+        reports = [onnx_runtime.compare_with_eager(reference, generator, example) for example in examples]
+    finally:
+        if has_dropout and os.path.exists(check_path):
+            os.remove(check_path)
+
+    print('%-20s %-8s %10s %10s %12s' % ('input', '', 'p50 [ms]', 'mean [ms]', 'max diff'))
+    for example, report in zip(examples, reports):
+        shape = 'x'.join(str(size) for size in example.shape)
+        print('%-20s %-8s %10.1f %10.1f %12s' % (shape, 'eager', report['eager']['p50_ms'], report['eager']['mean_ms'], '-'))
+        print('%-20s %-8s %10.1f %10.1f %12g' % (shape, 'onnx', report['onnx']['p50_ms'], report['onnx']['mean_ms'], report['max_diff']))
+    max_diff = max(report['max_diff'] for report in reports)
+    if max_diff > tolerance:
+        raise RuntimeError('the ONNX graph changes the generator output by %g' % max_diff)
+    return export_path
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse()  # get test options
+    model = create_model(opt)      # create a model given opt.model and other options
+    model.setup(opt)               # regular setup: load and print networks; create schedulers
+    netG = model.netG.module if isinstance(model.netG, torch.nn.DataParallel) else model.netG
+    example = torch.randn(1, opt.input_nc, opt.crop_size, opt.crop_size, device=model.device)
+    if opt.eval:
+        netG.eval()
+        networks.fold_batch_norm(netG, check_input=example)
+    else:
+        networks.convert_to_per_sample_norm(netG)
+
+    if opt.export_format == 'torchscript':
+        export_path = export_torchscript(opt, netG, example, model.save_dir)
+    elif opt.export_format == 'onnx':
+        # the graph has dynamic batch and image sizes, so it is also checked on another batch and image size
+        size = 256 if opt.crop_size != 256 else 512
+        examples = [example, torch.randn(2, opt.input_nc, size, size, device=model.device)]
+        export_path = export_onnx(opt, netG, examples, model.save_dir)
+    else:
+        raise NotImplementedError('export format [%s] is not recognized' % opt.export_format)
+    print('exported the generator to %s' % export_path)
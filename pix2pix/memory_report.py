@@ -0,0 +1,74 @@
+"""Compare the peak memory of the recursive and the flat U-Net generator at inference time.
+
+It will load the generator '<epoch>_net_G.pth' of a U-Net model (--netG unet_256 | unet_128) from '--checkpoints_dir',
+load the same state_dict into the flat variant (unet_256_flat | unet_128_flat, see networks.FlatUnetGenerator) and
+run both on a batch of <crop_size> x <crop_size> inputs. For every variant, it prints the peak memory that the
+forward pass needs on top of what is allocated before, and the largest difference of the outputs. The flat variant is
+measured twice: the first call allocates its concatenation buffers, the second one reuses them.
+
+On the GPU, the peak is read from the CUDA caching allocator; on the CPU, from the peak resident set size of the
+process, which is reset before every pass (Linux only).
+
+Example:
+    python memory_report.py --dataroot ./datasets/texgen --name texgen_p2p_Albedo --model pix2pix --load_size 1024 --crop_size 1024 --gpu_ids -1
+
+See options/base_options.py and options/test_options.py for more options.
+"""
+import torch
+from options.test_options import TestOptions
+from models import create_model, networks
+
+
+def _read_status(field):
+    """Return a memory field of /proc/self/status (e.g. VmRSS, VmHWM) in bytes"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError('%s is not reported in /proc/self/status' % field)
+
+
+def peak_memory(forward, input):
+    """Return the output of <forward>(<input>) and the peak memory in bytes that the call needed beyond the memory held before it"""
+    with torch.no_grad():
+        if input.is_cuda:
+            torch.cuda.synchronize(input.device)
+            torch.cuda.reset_peak_memory_stats(input.device)
+            before = torch.cuda.memory_allocated(input.device)
+            output = forward(input)
+            torch.cuda.synchronize(input.device)
+            return output, torch.cuda.max_memory_allocated(input.device) - before
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')  # reset the peak resident set size to the current one
+        before = _read_status('VmRSS')
+        output = forward(input)
+        return output, _read_status('VmHWM') - before
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse()  # get test options
+    if opt.netG not in ('unet_256', 'unet_128'):
+        raise ValueError('the flat variant exists for --netG unet_256 | unet_128 only')
+    model = create_model(opt)      # create a model given opt.model and other options
+    model.setup(opt)               # regular setup: load and print networks; create schedulers
+    netG = model.netG.module if isinstance(model.netG, torch.nn.DataParallel) else model.netG
+    flat = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG + '_flat', opt.norm, not opt.no_dropout,
+                             gpu_ids=opt.gpu_ids, seamless=opt.seamless)
+    flat = flat.module if isinstance(flat, torch.nn.DataParallel) else flat
+    flat.load_state_dict(netG.state_dict())
+    for net in [netG, flat]:
+        if opt.eval:
+            net.eval()
+        else:
+            networks.convert_to_per_sample_norm(net)
+        for m in net.modules():
+            if isinstance(m, torch.nn.Dropout):
+                m.eval()  # dropout draws different masks in every pass, which would hide differences of the outputs
+
+    input = torch.randn(opt.batch_size, opt.input_nc, opt.crop_size, opt.crop_size, device=model.device)
+    expected, recursive_peak = peak_memory(netG, input)
+    print('%-24s %10s %12s' % ('', 'peak [MiB]', 'max diff'))
+    print('%-24s %10.1f %12s' % ('recursive', recursive_peak / 2**20, '-'))
+    for name in ['flat (first call)', 'flat (buffers reused)']:
+        output, peak = peak_memory(flat, input)
+        print('%-24s %10.1f %12g' % (name, peak / 2**20, (output - expected).abs().max().item()))
@@ -2,7 +2,7 @@ import os
 import torch
 from collections import OrderedDict
 from abc import ABC, abstractmethod
-from . import networks
+from . import compilation, networks, quantization
 
 
 class BaseModel(ABC):
@@ -42,6 +42,7 @@ class BaseModel(ABC):
         self.optimizers = []
         self.image_paths = []
         self.metric = 0  # used for learning rate policy 'plateau'
+        self.inference_mode = False  # run <test> under torch.inference_mode; set by <compile>
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -95,13 +96,64 @@ class BaseModel(ABC):
                 net = getattr(self, 'net' + name)
                 net.eval()
 
+    def quantize(self):
+        """Replace the networks by reduced-precision copies as selected by --quantize (int8 | bf16)
+
+        The networks must take <input_nc>-channel images; the images in --calib_dir calibrate the INT8
+        activation ranges and measure the accuracy against the float32 networks.
+        Returns {network name: {output name: {'l1': ..., 'psnr': ...}}}; the outputs of a multi-head generator are
+        reported per map.
+        """
+        inputs = quantization.load_calibration_images(self.opt).to(self.device)
+        report = {}
+        for name in self.model_names:
+            if isinstance(name, str):
+                net = getattr(self, 'net' + name)
+                if isinstance(net, torch.nn.DataParallel):
+                    net = net.module
+                quantized = quantization.quantize_network(net, self.opt.quantize, inputs)
+                map_names = getattr(self, 'map_names', None) if name == 'G' else None
+                report[name] = quantization.compare_outputs(net, quantized, inputs, map_names)
+                for output_name, metrics in report[name].items():
+                    print('[Network %s] %s %s: L1 %.5f, PSNR %.2f dB' % (name, self.opt.quantize, output_name, metrics['l1'], metrics['psnr']))
+                setattr(self, 'net' + name, quantized)
+        return report
+
+    def compile(self):
+        """Prepare the networks for fast inference as selected by --channels_last and --compile
+
+        The networks run in channels_last layout and/or compiled with torch.compile (see models/compilation.py), and
+        <test> runs under torch.inference_mode. The generator is compiled right away by forward passes on <crop_size>
+        images: one on a batch whose size is marked dynamic, and one on a single image, since torch.compile specializes
+        sizes of 1; later batches of that image size do not compile again. Compiled kernels are kept in
+        --compile_cache_dir if it is given.
+        """
+        if self.opt.compile and self.opt.compile_cache_dir:
+            compilation.enable_compile_cache(self.opt.compile_cache_dir)
+        for name in self.model_names:
+            if isinstance(name, str):
+                net = getattr(self, 'net' + name)
+                if isinstance(net, torch.nn.DataParallel):
+                    net = net.module
+                setattr(self, 'net' + name, compilation.prepare_network(net, self.opt.channels_last, self.opt.compile))
+        self.inference_mode = True
+
+        if self.opt.compile and 'G' in self.model_names:
+            batch = torch.randn(2, self.opt.input_nc, self.opt.crop_size, self.opt.crop_size, device=self.device)
+            torch._dynamo.mark_dynamic(batch, 0)
+            with torch.inference_mode():
+                self.netG(batch)
+                self.netG(batch[:1].clone())  # a batch of one is specialized and compiled separately
+            if self.opt.compile_cache_dir:
+                compilation.save_compile_cache(self.opt.compile_cache_dir)
+
     def test(self):
         """Forward function used in test time.
 
-        This function wraps <forward> function in no_grad() so we don't save intermediate steps for backprop
-        It also calls <compute_visuals> to produce additional visualization results
+        This function wraps <forward> function in no_grad() (or inference_mode() after <compile>) so we don't save
+        intermediate steps for backprop. It also calls <compute_visuals> to produce additional visualization results
         """
-        with torch.no_grad():
+        with torch.inference_mode() if self.inference_mode else torch.no_grad():
             self.forward()
             self.compute_visuals()
 
@@ -173,11 +225,35 @@ class BaseModel(ABC):
         else:
             self.__patch_instance_norm_state_dict(state_dict, getattr(module, key), keys, i + 1)
 
+    def save_mmap_networks(self, epoch):
+        """Save the loaded networks in the format that <load_networks> memory-maps.
+
+        Parameters:
+            epoch (int) -- current epoch; used in the file name '%s_net_%s.mmap.pth' % (epoch, name)
+
+        The networks are saved after loading, so old InstanceNorm checkpoints are already patched.
+        """
+        for name in self.model_names:
+            if isinstance(name, str):
+                save_path = os.path.join(self.save_dir, '%s_net_%s.mmap.pth' % (epoch, name))
+                net = getattr(self, 'net' + name)
+                if isinstance(net, torch.nn.DataParallel):
+                    net = net.module
+                state_dict = {key: value.cpu() for key, value in net.state_dict().items()}
+                # the weights may be mapped from an earlier conversion, which must not be overwritten in place
+                torch.save(state_dict, save_path + '.tmp')
+                os.replace(save_path + '.tmp', save_path)
+                print('saved the memory-mappable model to %s' % save_path)
+
     def load_networks(self, epoch):
         """Load all the networks from the disk.
 
         Parameters:
             epoch (int) -- current epoch; used in the file name '%s_net_%s.pth' % (epoch, name)
+
+        If a converted checkpoint '%s_net_%s.mmap.pth' (see convert_checkpoints.py) exists, it is memory-mapped instead:
+        at test time on the CPU, the weights are not copied but used directly from the page cache, so processes that
+        load the same checkpoint share its memory. A converted checkpoint older than the '.pth' one is stale and ignored.
         """
         for name in self.model_names:
             if isinstance(name, str):
@@ -186,6 +262,15 @@ class BaseModel(ABC):
                 net = getattr(self, 'net' + name)
                 if isinstance(net, torch.nn.DataParallel):
                     net = net.module
+                mmap_path = os.path.join(self.save_dir, '%s_net_%s.mmap.pth' % (epoch, name))
+                if os.path.exists(mmap_path) and os.path.exists(load_path) and os.path.getmtime(mmap_path) < os.path.getmtime(load_path):
+                    print('Warning: %s is older than %s and is ignored; run convert_checkpoints.py again' % (mmap_path, load_path))
+                elif os.path.exists(mmap_path):
+                    print('loading the model from %s (memory-mapped)' % mmap_path)
+                    state_dict = torch.load(mmap_path, map_location='cpu', mmap=True, weights_only=True)
+                    # training keeps the optimizers' references to the current parameters, so the weights are copied
+                    net.load_state_dict(state_dict, assign=not self.isTrain and self.device.type == 'cpu')
+                    continue
                 print('loading the model from %s' % load_path)
                 # if you are using PyTorch newer than 0.4 (e.g., built from
                 # GitHub source), you can remove str() on self.device
@@ -0,0 +1,72 @@
+"""Channels-last memory layout and torch.compile for fast inference.
+
+<prepare_network> converts the weights of a network to the channels_last (NHWC) layout, in which the CPU convolution
+kernels of oneDNN run without reordering their inputs and outputs, and converts its inputs the same way; optionally,
+it compiles the network with torch.compile. A compiled network is specialized to the shapes it sees: every new input
+size is compiled once when it first occurs, so the networks should be warmed up with the sizes they will serve.
+
+Compiling a generator takes tens of seconds. <enable_compile_cache> keeps the compiled graphs and kernels in a
+directory, so a restarted process loads them instead of compiling again.
+"""
+import os
+import tempfile
+import torch
+
+_loaded_cache_dirs = set()
+
+
+def to_channels_last(module, args):
+    """Forward pre-hook that converts the input of a network to the channels_last layout"""
+    return tuple(arg.contiguous(memory_format=torch.channels_last) if isinstance(arg, torch.Tensor) and arg.dim() == 4 else arg
+                 for arg in args)
+
+
+def prepare_network(net, channels_last=True, compile=False):
+    """Return <net> prepared for inference: its weights and inputs in channels_last layout and/or compiled
+
+    The channels_last conversion happens in place and keeps the type and the state_dict of the network; the compiled
+    network is a wrapper whose state_dict keys are prefixed with '_orig_mod.', so it is meant for inference only.
+    """
+    if channels_last:
+        net.to(memory_format=torch.channels_last)
+        net.register_forward_pre_hook(to_channels_last)
+    if compile:
+        # the batch size is marked dynamic by the warm-up (see BaseModel.compile); all other shapes are specialized
+        net = torch.compile(net, dynamic=False)
+    return net
+
+
+def _artifacts_path(cache_dir):
+    return os.path.join(cache_dir, 'compile_artifacts.bin')
+
+
+def enable_compile_cache(cache_dir):
+    """Keep the graphs and kernels compiled by torch.compile in <cache_dir> and load those of earlier runs"""
+    import torch._inductor.config
+    import torch._functorch.config
+
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = cache_dir
+    torch._inductor.config.fx_graph_cache = True
+    if hasattr(torch._functorch.config, 'enable_autograd_cache'):
+        torch._functorch.config.enable_autograd_cache = True  # newer versions of torch only
+    path = _artifacts_path(cache_dir)
+    # newer versions of torch also bundle the compiled artifacts into one file that is loaded up front
+    if hasattr(torch.compiler, 'load_cache_artifacts') and cache_dir not in _loaded_cache_dirs and os.path.exists(path):
+        with open(path, 'rb') as f:
+            torch.compiler.load_cache_artifacts(f.read())
+        _loaded_cache_dirs.add(cache_dir)
+
+
+def save_compile_cache(cache_dir):
+    """Write the artifacts compiled by this process so far to <cache_dir> (see <enable_compile_cache>)"""
+    if not hasattr(torch.compiler, 'save_cache_artifacts'):
+        return  # the per-graph caches in TORCHINDUCTOR_CACHE_DIR are written while compiling
+    artifacts = torch.compiler.save_cache_artifacts()
+    if artifacts is None:
+        return
+    # other processes may read the file while it is replaced
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(artifacts[0])
+    os.replace(tmp_path, _artifacts_path(cache_dir))
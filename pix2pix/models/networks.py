@@ -1,5 +1,8 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+import copy
+import math
 from torch.nn import init
 import functools
 from torch.optim import lr_scheduler
@@ -117,23 +120,219 @@ def init_net(net, init_type='normal', init_gain=0.02, gpu_ids=[]):
     return net
 
 
-def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, init_type='normal', init_gain=0.02, gpu_ids=[]):
+def convert_to_per_sample_norm(net):
+    """Replace every BatchNorm2d layer of a network by a <PerSampleBatchNorm2d> layer, in place
+
+    Parameters:
+        net (network) -- the network to be converted
+
+    pix2pix generators also run in training mode at test time, where BatchNorm normalizes with the
+    statistics of the current batch. After this conversion, a batch of images gives the same result as
+    feeding the images one by one. The state_dict is unchanged.
+    """
+    for name, module in net.named_children():
+        if type(module) == nn.BatchNorm2d:
+            per_sample = PerSampleBatchNorm2d(module.num_features, module.eps, module.momentum, module.affine, module.track_running_stats)
+            per_sample.load_state_dict(module.state_dict())
+            per_sample.train(module.training)
+            setattr(net, name, per_sample.to(module.weight.device))
+        else:
+            convert_to_per_sample_norm(module)
+    return net
+
+
+def fuse_conv_batch_norm(conv, norm):
+    """Return a copy of a Conv2d or ConvTranspose2d layer with an eval-mode BatchNorm2d applied to its output folded in
+
+    Parameters:
+        conv -- the convolution; ConvTranspose2d layers must not be grouped
+        norm -- the BatchNorm2d layer that directly follows <conv>
+
+    In eval mode, BatchNorm2d scales and shifts every channel with constants computed from its running statistics,
+    so it can be merged into the weights and the bias of the convolution.
+    """
+    fused = copy.deepcopy(conv)
+    scale = norm.running_var.add(norm.eps).rsqrt()
+    shift = -norm.running_mean * scale
+    if norm.affine:
+        scale = scale * norm.weight
+        shift = shift * norm.weight + norm.bias
+    # the output channels are the first weight dimension of Conv2d and the second one of ConvTranspose2d
+    shape = [1, -1, 1, 1] if isinstance(conv, nn.ConvTranspose2d) else [-1, 1, 1, 1]
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(norm.running_mean)
+    with torch.no_grad():
+        fused.weight = nn.Parameter(conv.weight * scale.reshape(shape))
+        fused.bias = nn.Parameter(bias * scale + shift)
+    return fused
+
+
+def fold_batch_norm(net, check_input=None, tolerance=1e-3):
+    """Fold every BatchNorm2d layer that directly follows a convolution into the convolution, in place
+
+    Parameters:
+        net (network)         -- the network to be converted; it must be in eval mode
+        check_input (tensor)  -- if given, the outputs of the network for this input are compared before and after folding
+        tolerance (float)     -- the largest absolute difference between the outputs that is accepted
+
+    This works for all generators, whose convolutions and normalization layers are neighbours in nn.Sequential
+    containers. The folded BatchNorm2d layers are replaced by <Identity>, which saves one pass over the activations
+    per layer. Only eval-mode BatchNorm2d, which normalizes with its running statistics, can be folded: a network
+    that runs in training mode (or with <PerSampleBatchNorm2d> in training mode) is rejected.
+
+    Returns the largest absolute difference between the outputs, or None without <check_input>.
+    """
+    if net.training:
+        raise ValueError('BatchNorm can only be folded in eval mode')
+    if check_input is not None:
+        with torch.no_grad():
+            expected = net(check_input)
+
+    n_folded = 0
+    for module in list(net.modules()):
+        if not isinstance(module, nn.Sequential):
+            continue
+        children = list(module.named_children())
+        for (conv_name, conv), (norm_name, norm) in zip(children, children[1:]):
+            is_conv = isinstance(conv, nn.Conv2d) or (isinstance(conv, nn.ConvTranspose2d) and conv.groups == 1)
+            if is_conv and isinstance(norm, nn.BatchNorm2d) and norm.track_running_stats:
+                setattr(module, conv_name, fuse_conv_batch_norm(conv, norm))
+                setattr(module, norm_name, Identity())
+                n_folded += 1
+    print('folded %d BatchNorm layers into convolutions' % n_folded)
+
+    if check_input is None:
+        return None
+    with torch.no_grad():
+        error = (net(check_input) - expected).abs().max().item()
+    if error > tolerance:
+        raise RuntimeError('folding BatchNorm changed the network output by %g' % error)
+    return error
+
+
+def convert_to_circular_padding(net):
+    """Make every convolution and padding layer of a network wrap around the image borders, in place
+
+    Parameters:
+        net (network) -- the network to be converted
+
+    Conv2d layers switch to padding_mode='circular', ConvTranspose2d layers are replaced by <CircularConvTranspose2d>
+    and reflection/replication padding layers by <CircularPad2d>. The outputs of the converted network tile seamlessly
+    (for inputs whose size is divisible by the total downsampling factor). The state_dict is unchanged, so checkpoints
+    trained with either padding can be loaded.
+    """
+    for name, module in net.named_children():
+        if isinstance(module, nn.Conv2d):
+            module.padding_mode = 'circular'
+        elif type(module) == nn.ConvTranspose2d:
+            circular = CircularConvTranspose2d(module.in_channels, module.out_channels, module.kernel_size, module.stride, module.padding,
+                                               module.output_padding, module.groups, module.bias is not None, module.dilation)
+            circular.load_state_dict(module.state_dict())
+            circular.train(module.training)
+            setattr(net, name, circular.to(module.weight.device))
+        elif isinstance(module, (nn.ReflectionPad2d, nn.ReplicationPad2d)):
+            setattr(net, name, CircularPad2d(module.padding))
+        else:
+            convert_to_circular_padding(module)
+    return net
+
+
+def fuse_unet_generators(nets, check_input=None, tolerance=1e-3):
+    """Return one network that runs several UnetGenerators of the same architecture on the same input at once
+
+    Parameters:
+        nets (network list)  -- the generators; they must have the same layers, but may have different weights
+        check_input (tensor) -- if given, the outputs of the fused network for this input are compared with those of <nets>
+        tolerance (float)    -- the largest absolute difference between the outputs that is accepted
+
+    The first convolution, which sees the shared input, gets the filters of all generators; every later convolution
+    becomes a grouped convolution with one group per generator, and the normalization layers normalize the channels of
+    all generators side by side. A forward pass of the fused network runs one (wider) kernel per layer instead of one
+    per layer and generator. The outputs of the generators are concatenated along the channel dimension, in the order
+    of <nets>. Every channel is computed from the same weights and inputs as in its own generator, so batch statistics,
+    per-sample normalization, folded BatchNorm and circular padding behave as before; only dropout draws different
+    masks, which is why the dropout layers are disabled while the outputs are compared.
+    """
+    nets = [getattr(net, 'module', net) for net in nets]  # unwrap DataParallel
+    if not all(isinstance(net, UnetGenerator) for net in nets):
+        raise ValueError('only UnetGenerators can be fused')
+    fused = FusedUnetGenerator(nets).train(nets[0].training).to(next(nets[0].parameters()).device)
+    if check_input is None:
+        return fused
+
+    dropouts = [m for net in nets + [fused] for m in net.modules() if isinstance(m, nn.Dropout) and m.training]
+    for m in dropouts:
+        m.eval()
+    try:
+        with torch.no_grad():
+            expected = torch.cat([net(check_input) for net in nets], 1)
+            error = (fused(check_input) - expected).abs().max().item()
+    finally:
+        for m in dropouts:
+            m.train()
+    print('fused %d generators, largest output difference %g%s' % (len(nets), error, ' (bit-identical)' if error == 0 else ''))
+    if error > tolerance:
+        raise RuntimeError('fusing the generators changed their outputs by %g' % error)
+    return fused
+
+
+def _fuse_layers(layers, shared_input):
+    """Return one layer that applies <layers> (one per generator) to their inputs, concatenated along the channels"""
+    layer = layers[0]
+    groups = len(layers)
+    if any(type(other) != type(layer) for other in layers):
+        raise ValueError('the generators have different layers')
+    if isinstance(layer, UnetSkipConnectionBlock):
+        return FusedUnetSkipConnectionBlock(layers, shared_input)
+    if isinstance(layer, (nn.Conv2d, nn.ConvTranspose2d)):
+        if layer.groups != 1:
+            raise ValueError('grouped convolutions cannot be fused')
+        if isinstance(layer, nn.Conv2d):
+            # with a shared input, every generator's filters see all input channels
+            in_channels = layer.in_channels if shared_input else layer.in_channels * groups
+            fused = nn.Conv2d(in_channels, layer.out_channels * groups, layer.kernel_size, layer.stride, layer.padding,
+                              layer.dilation, 1 if shared_input else groups, layer.bias is not None, layer.padding_mode)
+        else:
+            if shared_input:
+                raise ValueError('the first layer of a fused generator must be a Conv2d')
+            fused = type(layer)(layer.in_channels * groups, layer.out_channels * groups, layer.kernel_size, layer.stride,
+                                layer.padding, layer.output_padding, groups, layer.bias is not None, layer.dilation)
+        # grouped weights are the weights of the groups one after another along the first dimension
+        with torch.no_grad():
+            fused.weight.copy_(torch.cat([other.weight for other in layers]))
+            if layer.bias is not None:
+                fused.bias.copy_(torch.cat([other.bias for other in layers]))
+    elif isinstance(layer, (nn.BatchNorm2d, nn.InstanceNorm2d)):
+        fused = type(layer)(layer.num_features * groups, layer.eps, layer.momentum, layer.affine, layer.track_running_stats)
+        state = {name: torch.cat([other.state_dict()[name] for other in layers]) if value.dim() > 0 else value
+                 for name, value in layer.state_dict().items()}
+        fused.load_state_dict(state)
+    elif isinstance(layer, (Identity, nn.ReLU, nn.LeakyReLU, nn.Tanh, nn.Dropout)):
+        return copy.deepcopy(layer)  # elementwise
+    else:
+        raise ValueError('layer [%s] cannot be fused' % type(layer).__name__)
+    return fused
+
+
+def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, init_type='normal', init_gain=0.02, gpu_ids=[], n_heads=1, seamless=False):
     """Create a generator
 
     Parameters:
         input_nc (int) -- the number of channels in input images
         output_nc (int) -- the number of channels in output images
         ngf (int) -- the number of filters in the last conv layer
-        netG (str) -- the architecture's name: resnet_9blocks | resnet_6blocks | unet_256 | unet_128
+        netG (str) -- the architecture's name: resnet_9blocks | resnet_6blocks | unet_256 | unet_128 | unet_256_flat | unet_128_flat |
+                      unet_256_multihead | unet_128_multihead
         norm (str) -- the name of normalization layers used in the network: batch | instance | none
         use_dropout (bool) -- if use dropout layers.
         init_type (str)    -- the name of our initialization method.
         init_gain (float)  -- scaling factor for normal, xavier and orthogonal.
         gpu_ids (int list) -- which GPUs the network runs on: e.g., 0,1,2
+        n_heads (int)      -- the number of decoder heads; only used by the *_multihead generators
+        seamless (bool)    -- pad all convolutions circularly, so that the outputs tile (see <convert_to_circular_padding>)
 
     Returns a generator
 
-    Our current implementation provides two types of generators:
+    Our current implementation provides three types of generators:
         U-Net: [unet_128] (for 128x128 input images) and [unet_256] (for 256x256 input images)
         The original U-Net paper: https://arxiv.org/abs/1505.04597
 
@@ -141,6 +340,13 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, in
         Resnet-based generator consists of several Resnet blocks between a few downsampling/upsampling operations.
         We adapt Torch code from Justin Johnson's neural style transfer project (https://github.com/jcjohnson/fast-neural-style).
 
+        Flat U-Net: [unet_128_flat] and [unet_256_flat]
+        The U-Net above with a memory-saving forward pass for inference (see <FlatUnetGenerator>); it loads the same checkpoints.
+
+        Multi-head U-Net: [unet_128_multihead] and [unet_256_multihead]
+        A U-Net whose encoder is shared by <n_heads> decoders; one forward pass predicts all output maps,
+        stacked along the channel dimension (output_nc * n_heads channels).
+
 
     The generator has been initialized by <init_net>. It uses RELU for non-linearity.
     """
@@ -155,8 +361,18 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, in
         net = UnetGenerator(input_nc, output_nc, 7, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
     elif netG == 'unet_256':
         net = UnetGenerator(input_nc, output_nc, 8, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
+    elif netG == 'unet_128_flat':
+        net = FlatUnetGenerator(input_nc, output_nc, 7, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
+    elif netG == 'unet_256_flat':
+        net = FlatUnetGenerator(input_nc, output_nc, 8, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
+    elif netG == 'unet_128_multihead':
+        net = MultiHeadUnetGenerator(input_nc, output_nc, 7, n_heads, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
+    elif netG == 'unet_256_multihead':
+        net = MultiHeadUnetGenerator(input_nc, output_nc, 8, n_heads, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
     else:
         raise NotImplementedError('Generator model name [%s] is not recognized' % netG)
+    if seamless:
+        convert_to_circular_padding(net)
     return init_net(net, init_type, init_gain, gpu_ids)
 
 
@@ -313,6 +529,50 @@ def cal_gradient_penalty(netD, real_data, fake_data, device, type='mixed', const
         return 0.0, None
 
 
+class PerSampleBatchNorm2d(nn.BatchNorm2d):
+    """BatchNorm2d that normalizes every sample with its own statistics in training mode
+
+    This is exactly what BatchNorm2d computes for a batch of size 1. Running statistics are not updated;
+    in eval mode the layer behaves like BatchNorm2d.
+    """
+
+    def forward(self, input):
+        if not self.training:
+            return super(PerSampleBatchNorm2d, self).forward(input)
+        return F.instance_norm(input, weight=self.weight, bias=self.bias, eps=self.eps)
+
+
+class CircularPad2d(nn.Module):
+    """Pad the borders of an image with the pixels of the opposite borders"""
+
+    def __init__(self, padding):
+        super(CircularPad2d, self).__init__()
+        self.padding = tuple(padding) if isinstance(padding, (tuple, list)) else (padding,) * 4
+
+    def forward(self, input):
+        return F.pad(input, self.padding, mode='circular')
+
+
+class CircularConvTranspose2d(nn.ConvTranspose2d):
+    """ConvTranspose2d whose input wraps around at the borders
+
+    ConvTranspose2d only supports zero padding. Here, the input is padded circularly by as many pixels as
+    contribute to the border outputs, and the output is cropped by the corresponding number of pixels more.
+    The parameters are those of ConvTranspose2d.
+    """
+
+    def forward(self, input, output_size=None):
+        wrap = []
+        padding = []
+        for k, s, p, d, op in zip(self.kernel_size, self.stride, self.padding, self.dilation, self.output_padding):
+            # input pixels beyond the first and the last one that reach into the output
+            q = max(math.ceil((d * (k - 1) - p) / s), (d * (k - 1) - p + op) // s, 0)
+            wrap.append(q)
+            padding.append(p + q * s)
+        input = F.pad(input, (wrap[1], wrap[1], wrap[0], wrap[0]), mode='circular')
+        return F.conv_transpose2d(input, self.weight, self.bias, self.stride, tuple(padding), self.output_padding, self.groups, self.dilation)
+
+
 class ResnetGenerator(nn.Module):
     """Resnet-based generator that consists of Resnet blocks between a few downsampling/upsampling operations.
 
@@ -466,6 +726,106 @@ class UnetGenerator(nn.Module):
         return self.model(input)
 
 
+class FlatUnetGenerator(UnetGenerator):
+    """A UnetGenerator whose inference forward pass runs level by level instead of recursively
+
+    The layers (and so the state_dict) are those of <UnetGenerator>. Every UnetSkipConnectionBlock below the outermost
+    one returns torch.cat([x, self.model(x)], 1), which allocates a new tensor of twice the channels per level on every
+    call, while x and self.model(x) are still alive. Here, every level owns a concatenation buffer: the input of the
+    level is copied into its first half right away (and released), and the output of the decoder below is copied into
+    its second half once it is computed. The buffers are kept in an arena, one storage per level, and reused by the
+    next calls: a storage is allocated for at least <max_batch_size> inputs and only grows, so smaller batches and
+    images take a view of it. The buffers follow the memory format of the input (NCHW or channels_last).
+    <arena_nbytes> tells how much memory the arena takes for a given input size.
+
+    The flat pass is used without autograd only (under torch.no_grad or torch.inference_mode); for training, tracing,
+    scripting and torch.compile the recursive forward runs. The arena is shared by all calls, so a network must not
+    run two batches at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FlatUnetGenerator, self).__init__(*args, **kwargs)
+        blocks = [self.model]
+        while True:
+            inner = [m for m in blocks[-1].model if isinstance(m, UnetSkipConnectionBlock)]
+            if not inner:
+                break
+            blocks.append(inner[0])
+        self.blocks = tuple(blocks)  # from the outermost to the innermost; a tuple does not register them a second time
+        self.arena = {}  # level -> (dtype, device, inference mode), flat storage of the concatenation buffer
+        self.max_batch_size = 1  # the batch size that the storages are allocated for at least
+
+    def forward(self, input):
+        """Standard forward"""
+        if not torch.jit.is_scripting():
+            if not (torch.is_grad_enabled() or torch.jit.is_tracing() or _is_compiling()):
+                return self._flat_forward(input)
+        return self.model(input)
+
+    def arena_nbytes(self, batch_size, height, width, element_size=4):
+        """Return the bytes that the arena holds after a call on <batch_size> x input_nc x <height> x <width> inputs"""
+        nbytes = 0
+        for level, block in enumerate(self.blocks[1:], 1):
+            channels = next(m.in_channels for m in block.model if hasattr(m, 'in_channels'))  # of the down convolution
+            nbytes += batch_size * 2 * channels * (height >> level) * (width >> level) * element_size
+        return nbytes
+
+    def _buffer(self, level, x):
+        """Return the concatenation buffer of <level> for the input <x>, a view of the storage of the level in the arena"""
+        n, c, h, w = x.shape
+        key = (x.dtype, x.device, torch.is_inference_mode_enabled())
+        numel = n * 2 * c * h * w
+        storage = self.arena.get(level)
+        if storage is None or storage[0] != key or storage[1].numel() < numel:
+            capacity = max(n, self.max_batch_size) * 2 * c * h * w
+            if storage is not None and storage[0] == key:
+                capacity = max(capacity, storage[1].numel())
+            self.arena.pop(level, None)  # release the old storage before allocating the new one
+            storage = (key, torch.empty(capacity, dtype=x.dtype, device=x.device))
+            self.arena[level] = storage
+        flat = storage[1][:numel]
+        if not x.is_contiguous() and x.is_contiguous(memory_format=torch.channels_last):
+            return flat.view(n, h, w, 2 * c).permute(0, 3, 1, 2)
+        return flat.view(n, 2 * c, h, w)
+
+    def _flat_forward(self, input):
+        n_levels = len(self.blocks)
+        buffers = [None] * n_levels
+        ups = []
+        x = input
+        # downsampling: every level stores its input in its buffer and passes on the output of its down layers
+        for level, block in enumerate(self.blocks):
+            layers = list(block.model)
+            if level + 1 < n_levels:
+                split = layers.index(self.blocks[level + 1])
+                down, up = layers[:split], layers[split + 1:]
+            else:
+                split = next(i for i, m in enumerate(layers) if isinstance(m, nn.ReLU))  # the innermost level has no submodule
+                down, up = layers[:split], layers[split:]
+            ups.append(up)
+            if level > 0:
+                buffers[level] = self._buffer(level, x)
+                skip = buffers[level][:, :x.size(1)]
+                skip.copy_(x)
+                x = skip  # the LeakyReLU of the down layers works in place, like in UnetSkipConnectionBlock
+            for layer in down:
+                x = layer(x)
+
+        # upsampling: every level reads the buffer of the level below and writes into the second half of its own
+        for level in reversed(range(n_levels)):
+            if level + 1 < n_levels:
+                x = buffers[level + 1]
+            for layer in ups[level]:
+                x = layer(x)
+            if level > 0:
+                buffers[level][:, buffers[level].size(1) - x.size(1):].copy_(x)
+        return x
+
+
+def _is_compiling():
+    return hasattr(torch, 'compiler') and hasattr(torch.compiler, 'is_compiling') and torch.compiler.is_compiling()
+
+
 class UnetSkipConnectionBlock(nn.Module):
     """Defines the Unet submodule with skip connection.
         X -------------------identity----------------------
@@ -536,6 +896,112 @@ class UnetSkipConnectionBlock(nn.Module):
             return torch.cat([x, self.model(x)], 1)
 
 
+class FusedUnetGenerator(nn.Module):
+    """Several UnetGenerators of the same architecture evaluated as one network (see <fuse_unet_generators>)"""
+
+    def __init__(self, nets):
+        super(FusedUnetGenerator, self).__init__()
+        self.n_nets = len(nets)
+        self.model = FusedUnetSkipConnectionBlock([net.model for net in nets], shared_input=True)
+
+    def forward(self, input):
+        """Return the outputs of all generators, concatenated along the channel dimension"""
+        return self.model(input)
+
+
+class FusedUnetSkipConnectionBlock(nn.Module):
+    """The UnetSkipConnectionBlocks of several generators at the same level, with the channels of every generator side by side"""
+
+    def __init__(self, blocks, shared_input=False):
+        super(FusedUnetSkipConnectionBlock, self).__init__()
+        self.outermost = blocks[0].outermost
+        self.groups = len(blocks)
+        # only the first layer of the outermost block sees the shared input
+        self.model = nn.Sequential(*[_fuse_layers(layers, shared_input and i == 0) for i, layers in enumerate(zip(*[block.model for block in blocks]))])
+
+    def forward(self, x):
+        if self.outermost:
+            return self.model(x)
+        # the skip connection concatenates the input and the output of every generator separately
+        y = self.model(x)
+        n, _, h, w = y.shape
+        return torch.cat([x.reshape(n, self.groups, -1, h, w), y.reshape(n, self.groups, -1, h, w)], 2).reshape(n, -1, h, w)
+
+
+class MultiHeadUnetGenerator(nn.Module):
+    """Create a Unet-based generator with one shared encoder and one decoder head per output map"""
+
+    def __init__(self, input_nc, output_nc, num_downs, n_heads, ngf=64, norm_layer=nn.BatchNorm2d, use_dropout=False):
+        """Construct a multi-head Unet generator
+        Parameters:
+            input_nc (int)  -- the number of channels in input images
+            output_nc (int) -- the number of channels in the output image of every head
+            num_downs (int) -- the number of downsamplings in UNet (see <UnetGenerator>)
+            n_heads (int)   -- the number of decoder heads
+            ngf (int)       -- the number of filters in the last conv layer
+            norm_layer      -- normalization layer
+
+        Every level uses the same layers as <UnetSkipConnectionBlock>, but the downsampling half is
+        built once and its activations are shared by all heads, so a forward pass costs one encoder
+        plus <n_heads> decoders. The outputs of the heads are concatenated along the channel dimension.
+        """
+        super(MultiHeadUnetGenerator, self).__init__()
+        if type(norm_layer) == functools.partial:
+            use_bias = norm_layer.func == nn.InstanceNorm2d
+        else:
+            use_bias = norm_layer == nn.InstanceNorm2d
+        # (outer_nc, inner_nc) of every level, from the outermost to the innermost layer
+        levels = [(input_nc, ngf), (ngf, ngf * 2), (ngf * 2, ngf * 4), (ngf * 4, ngf * 8)] + [(ngf * 8, ngf * 8)] * (num_downs - 4)
+        innermost = len(levels) - 1
+
+        encoder = []
+        for i, (outer_nc, inner_nc) in enumerate(levels):
+            downconv = nn.Conv2d(outer_nc, inner_nc, kernel_size=4, stride=2, padding=1, bias=use_bias)
+            if i == 0:
+                encoder.append(nn.Sequential(downconv))
+            elif i == innermost:
+                encoder.append(nn.Sequential(nn.LeakyReLU(0.2, True), downconv))
+            else:
+                encoder.append(nn.Sequential(nn.LeakyReLU(0.2, True), downconv, norm_layer(inner_nc)))
+        self.encoder = nn.ModuleList(encoder)
+
+        heads = []
+        for _ in range(n_heads):
+            decoder = []
+            for i, (outer_nc, inner_nc) in enumerate(levels):
+                if i == 0:
+                    upconv = nn.ConvTranspose2d(inner_nc * 2, output_nc, kernel_size=4, stride=2, padding=1)
+                    decoder.append(nn.Sequential(nn.ReLU(True), upconv, nn.Tanh()))
+                elif i == innermost:
+                    # the innermost activation is shared by all heads, so it must not be rectified in place
+                    upconv = nn.ConvTranspose2d(inner_nc, outer_nc, kernel_size=4, stride=2, padding=1, bias=use_bias)
+                    decoder.append(nn.Sequential(nn.ReLU(), upconv, norm_layer(outer_nc)))
+                else:
+                    upconv = nn.ConvTranspose2d(inner_nc * 2, outer_nc, kernel_size=4, stride=2, padding=1, bias=use_bias)
+                    up = [nn.ReLU(True), upconv, norm_layer(outer_nc)]
+                    if use_dropout and i > 3:  # same placement as the intermediate ngf * 8 blocks of <UnetGenerator>
+                        up += [nn.Dropout(0.5)]
+                    decoder.append(nn.Sequential(*up))
+            heads.append(nn.ModuleList(decoder))
+        self.heads = nn.ModuleList(heads)
+
+    def forward(self, input):
+        """Encode once, decode with every head and stack the head outputs along the channel dimension"""
+        skips = []
+        x = input
+        for down in self.encoder:
+            x = down(x)
+            skips.append(x)
+
+        outputs = []
+        for decoder in self.heads:
+            y = decoder[-1](skips[-1])
+            for up, skip in zip(reversed(decoder[:-1]), reversed(skips[:-1])):
+                y = up(torch.cat([skip, y], 1))
+            outputs.append(y)
+        return torch.cat(outputs, 1)
+
+
 class NLayerDiscriminator(nn.Module):
     """Defines a PatchGAN discriminator"""
 
@@ -0,0 +1,79 @@
+"""ONNX export of generators and CPU inference with ONNX Runtime.
+
+<export_onnx> writes a generator as an ONNX graph whose batch size and image size are dynamic, and <OnnxGenerator>
+runs such a graph with ONNX Runtime's CPU execution provider, with all graph optimizations enabled and a fixed
+number of threads. <compare_with_eager> checks that the exported graph computes what the eager generator computes
+and measures the latency of both side by side.
+
+ONNX Runtime ('pip install onnxruntime') is only needed to run the graphs, the export itself needs the 'onnx' package.
+"""
+import os
+import time
+import torch
+
+
+def export_onnx(net, example, path, opset=17):
+    """Export <net> to the ONNX file <path>, traced on the NxCxHxW tensor <example>
+
+    The input 'real_A' and the output 'fake_B' have dynamic batch, height and width dimensions. A network in training
+    mode is exported in training mode, so normalization layers keep using batch statistics (see
+    networks.convert_to_per_sample_norm) and dropout stays active.
+    """
+    dynamic_axes = {'real_A': {0: 'batch', 2: 'height', 3: 'width'}, 'fake_B': {0: 'batch', 2: 'height', 3: 'width'}}
+    training = torch.onnx.TrainingMode.TRAINING if net.training else torch.onnx.TrainingMode.EVAL
+    with torch.no_grad():
+        torch.onnx.export(net, example, path, input_names=['real_A'], output_names=['fake_B'], dynamic_axes=dynamic_axes,
+                          opset_version=opset, training=training, do_constant_folding=not net.training)
+
+
+class OnnxGenerator:
+    """Run an exported generator with ONNX Runtime on the CPU; takes and returns torch tensors like the generator"""
+
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=1):
+        """
+        Parameters:
+            path (str)             -- the ONNX file written by <export_onnx>
+            intra_op_threads (int) -- threads that run one operator; 0 lets ONNX Runtime use one per physical core
+            inter_op_threads (int) -- threads that run independent operators in parallel; generators are a chain of
+                                      operators, so more than 1 only helps multi-head graphs
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+        self.path = path
+        self.nbytes = os.path.getsize(path)  # the weights make up almost all of the file
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input):
+        output = self.session.run(None, {self.input_name: input.detach().cpu().float().numpy()})[0]
+        return torch.from_numpy(output)
+
+
+def measure_latency(forward, input, iterations=10, warmup=2):
+    """Return the median and the mean latency of <forward>(<input>) in milliseconds"""
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + iterations):
+            start = time.perf_counter()
+            forward(input)
+            if i >= warmup:
+                times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {'p50_ms': times[len(times) // 2], 'mean_ms': sum(times) / len(times)}
+
+
+def compare_with_eager(net, onnx_generator, input, iterations=10):
+    """Compare an exported generator with the eager network it was exported from
+
+    Returns {'max_diff': largest absolute output difference, 'eager': latency, 'onnx': latency} (see <measure_latency>).
+    The outputs only match for networks without active dropout, i.e. in eval mode.
+    """
+    with torch.no_grad():
+        expected = net(input)
+    max_diff = (onnx_generator(input) - expected.cpu()).abs().max().item()
+    return {'max_diff': max_diff, 'eager': measure_latency(net, input, iterations), 'onnx': measure_latency(onnx_generator, input, iterations)}
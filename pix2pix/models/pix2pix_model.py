@@ -10,6 +10,8 @@ class Pix2PixModel(BaseModel):
     By default, it uses a '--netG unet256' U-Net generator,
     a '--netD basic' discriminator (PatchGAN),
     and a '--gan_mode' vanilla GAN loss (the cross-entropy objective used in the orignal GAN paper).
+    With '--netG unet_256_multihead', one generator predicts every map listed in '--map_names'
+    from a shared encoder; the aligned dataset then provides A|B_1|...|B_n image strips.
 
     pix2pix paper: https://arxiv.org/pdf/1611.07004.pdf
     """
@@ -30,6 +32,7 @@ class Pix2PixModel(BaseModel):
         """
         # changing the default values to match the pix2pix paper (https://phillipi.github.io/pix2pix/)
         parser.set_defaults(norm='batch', netG='unet_256', dataset_mode='aligned')
+        parser.add_argument('--map_names', type=str, default='Albedo,Normal,Height,Roughness,Metallic', help='comma-separated names of the maps predicted by a *_multihead generator, in the order of the B panels')
         if is_train:
             parser.set_defaults(pool_size=0, gan_mode='vanilla')
             parser.add_argument('--lambda_L1', type=float, default=100.0, help='weight for L1 loss')
@@ -47,6 +50,11 @@ class Pix2PixModel(BaseModel):
         self.loss_names = ['G_GAN', 'G_L1', 'D_real', 'D_fake']
         # specify the images you want to save/display. The training/test scripts will call <BaseModel.get_current_visuals>
         self.visual_names = ['real_A', 'fake_B', 'real_B']
+        # a *_multihead generator predicts one map per decoder head, stacked along the channel dimension of fake_B
+        self.map_names = opt.map_names.split(',') if opt.netG.endswith('_multihead') else []
+        n_maps = max(len(self.map_names), 1)
+        if self.map_names:
+            self.visual_names = ['real_A'] + ['fake_B_' + name for name in self.map_names] + ['real_B_' + name for name in self.map_names]
         # specify the models you want to save to the disk. The training/test scripts will call <BaseModel.save_networks> and <BaseModel.load_networks>
         if self.isTrain:
             self.model_names = ['G', 'D']
@@ -54,10 +62,10 @@ class Pix2PixModel(BaseModel):
             self.model_names = ['G']
         # define networks (both generator and discriminator)
         self.netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, opt.norm,
-                                      not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
+                                      not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids, n_heads=n_maps, seamless=opt.seamless)
 
         if self.isTrain:  # define a discriminator; conditional GANs need to take both input and output images; Therefore, #channels for D is input_nc + output_nc
-            self.netD = networks.define_D(opt.input_nc + opt.output_nc, opt.ndf, opt.netD,
+            self.netD = networks.define_D(opt.input_nc + opt.output_nc * n_maps, opt.ndf, opt.netD,
                                           opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
 
         if self.isTrain:
@@ -87,6 +95,12 @@ class Pix2PixModel(BaseModel):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
         self.fake_B = self.netG(self.real_A)  # G(A)
 
+    def compute_visuals(self):
+        """Split the stacked outputs of a *_multihead generator into one visual per map"""
+        for name, fake_B, real_B in zip(self.map_names, self.fake_B.split(self.opt.output_nc, 1), self.real_B.split(self.opt.output_nc, 1)):
+            setattr(self, 'fake_B_' + name, fake_B)
+            setattr(self, 'real_B_' + name, real_B)
+
     def backward_D(self):
         """Calculate GAN loss for the discriminator"""
         # Fake; stop backprop to the generator by detaching fake_B
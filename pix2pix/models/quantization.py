@@ -0,0 +1,110 @@
+"""Reduced-precision CPU inference for generators.
+
+Two modes are supported, selected with '--quantize' in TestOptions:
+    -- int8: post-training static INT8 quantization (FX graph mode). Activation ranges are calibrated
+             on the images in '--calib_dir'. BatchNorm is folded into the convolutions, so this needs
+             an eval-mode network ('--eval').
+    -- bf16: the network runs under CPU autocast to bfloat16; works in training and eval mode.
+
+<compare_outputs> measures the quality delta against the float32 network (L1 and PSNR per output map),
+so the speedup can be weighed against a measured loss of accuracy.
+"""
+import copy
+import math
+import torch
+import torch.nn as nn
+from data.base_dataset import get_params, get_preprocessor
+from data.image_folder import make_dataset
+from PIL import Image
+
+
+class Bfloat16Generator(nn.Module):
+    """Run a network under CPU autocast to bfloat16 and return float32 outputs"""
+
+    def __init__(self, net):
+        super(Bfloat16Generator, self).__init__()
+        self.net = net
+
+    def forward(self, input):
+        with torch.autocast('cpu', dtype=torch.bfloat16):
+            return self.net(input).float()
+
+
+def load_calibration_images(opt):
+    """Load up to <opt.calib_size> images from <opt.calib_dir>, preprocessed like test inputs
+
+    Returns an Nx<input_nc>xHxW tensor.
+    """
+    paths = make_dataset(opt.calib_dir, opt.calib_size)
+    if len(paths) == 0:
+        raise RuntimeError('Found 0 calibration images in: %s' % opt.calib_dir)
+    images = [Image.open(path).convert('RGB') for path in paths]
+    preprocessor = get_preprocessor(opt, grayscale=(opt.input_nc == 1))
+    return preprocessor.batch(images, [get_params(opt, image.size) for image in images])
+
+
+def quantize_int8(net, inputs, backend='fbgemm'):
+    """Return a statically INT8-quantized copy of an eval-mode network
+
+    Parameters:
+        net (network)   -- the float32 network; it must be in eval mode
+        inputs (tensor) -- calibration inputs; they are fed one by one to observe the activation ranges
+        backend (str)   -- the quantized engine: fbgemm (x86) | qnnpack (ARM)
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    if net.training:
+        raise ValueError('static INT8 quantization needs an eval-mode network; use --eval')
+    torch.backends.quantized.engine = backend
+    prepared = prepare_fx(copy.deepcopy(net), get_default_qconfig_mapping(backend), example_inputs=(inputs[:1],))
+    with torch.no_grad():
+        for input in inputs.split(1):
+            prepared(input)
+    return convert_fx(prepared)
+
+
+def quantize_network(net, mode, inputs=None):
+    """Return a copy of <net> for reduced-precision inference: int8 | bf16"""
+    if mode == 'int8':
+        return quantize_int8(net, inputs)
+    elif mode == 'bf16':
+        return Bfloat16Generator(net)
+    else:
+        raise NotImplementedError('quantization mode [%s] is not recognized' % mode)
+
+
+def compare_outputs(reference, candidate, inputs, names=None):
+    """Compare the outputs of two networks, image by image
+
+    Parameters:
+        reference (network) -- the float32 network
+        candidate (network) -- the reduced-precision network
+        inputs (tensor)     -- the test inputs
+        names (str list)    -- names of equally sized channel groups of the output (e.g. the maps of a multi-head generator)
+
+    The random state is reset before every forward pass, so networks with dropout draw the same masks.
+    Returns {name: {'l1': mean absolute error, 'psnr': PSNR in dB}} for outputs in [-1, 1].
+    """
+    names = names or ['output']
+    l1 = [0.0] * len(names)
+    se = [0.0] * len(names)
+    n = [0] * len(names)
+    with torch.no_grad():
+        for input in inputs.split(1):
+            torch.manual_seed(0)
+            expected = reference(input)
+            torch.manual_seed(0)
+            actual = candidate(input)
+            diffs = (actual.float() - expected.float()).chunk(len(names), dim=1)
+            for i, diff in enumerate(diffs):
+                l1[i] += diff.abs().sum().item()
+                se[i] += diff.pow(2).sum().item()
+                n[i] += diff.numel()
+
+    report = {}
+    for i, name in enumerate(names):
+        mse = se[i] / n[i]
+        # the outputs span [-1, 1], so the peak-to-peak value is 2
+        report[name] = {'l1': l1[i] / n[i], 'psnr': 10 * math.log10(4 / mse) if mse > 0 else float('inf')}
+    return report
@@ -0,0 +1,72 @@
+"""Tiled inference for inputs of any resolution.
+
+<tiled_forward> runs a network over overlapping square tiles of its input and blends the tile outputs with
+feathered windows: every tile is weighted by a ramp that falls off towards its edges, so the tiles fade into
+each other across the overlap instead of leaving seams. Memory per forward pass is bounded by the tile size
+and the number of tiles run at once, and the output keeps the resolution of the input.
+
+The networks must map a tile to an output tile of the same size, which holds for all generators whose tile
+size is divisible by their total downsampling factor (e.g. 256 for unet_256). Normalization layers that use
+batch statistics see one tile at a time (see networks.convert_to_per_sample_norm), so their statistics differ
+from tile to tile; the feathering hides the resulting differences.
+"""
+import torch
+import torch.nn.functional as F
+
+
+def feather_window(size, overlap):
+    """Return a 1D weight ramp of <size> that rises over the first <overlap> + 1 positions, stays at 1 and falls at the end"""
+    ramp = torch.arange(1, size + 1, dtype=torch.float32)
+    ramp = torch.minimum(ramp, ramp.flip(0)) / (overlap + 1)
+    return ramp.clamp(max=1)
+
+
+def tile_starts(length, tile_size, overlap):
+    """Return the start offsets of tiles of <tile_size> that cover <length> and overlap by at least <overlap>"""
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+
+def tiled_forward(forward, input, tile_size=1024, overlap=128, batch_size=1, wrap=False):
+    """Run <forward> over overlapping tiles of <input> and blend the tile outputs
+
+    Parameters:
+        forward (callable) -- maps an NxCxTxT tensor to an NxC'xTxT tensor, e.g. a generator
+        input (tensor)     -- NxCxHxW input of any size; smaller inputs are padded to one tile
+        tile_size (int)    -- the side T of a tile
+        overlap (int)      -- the minimal overlap of neighbouring tiles; it must be smaller than <tile_size>
+        batch_size (int)   -- how many tiles are passed to <forward> at once
+        wrap (bool)        -- treat the input as tileable: the borders are blended with the opposite borders,
+                              which keeps the output of a seamless generator (--seamless) tileable
+
+    Returns the NxC'xHxW output.
+    """
+    if not 0 <= overlap < tile_size:
+        raise ValueError('the overlap must be smaller than the tile size')
+    n, _, h, w = input.shape
+    margin = min(overlap, h, w) if wrap else 0
+    if margin:
+        input = F.pad(input, (margin, margin, margin, margin), mode='circular')
+    pad_h, pad_w = max(0, tile_size - input.size(2)), max(0, tile_size - input.size(3))
+    if pad_h or pad_w:
+        # reflection padding continues the texture, but it needs more pixels than it pads
+        mode = 'reflect' if pad_h < input.size(2) and pad_w < input.size(3) else 'replicate'
+        input = F.pad(input, (0, pad_w, 0, pad_h), mode=mode)
+    height, width = input.shape[2:]
+
+    window = torch.outer(feather_window(tile_size, overlap), feather_window(tile_size, overlap)).to(input.device)
+    tiles = [(y, x) for y in tile_starts(height, tile_size, overlap) for x in tile_starts(width, tile_size, overlap)]
+    output = None
+    weight = input.new_zeros(1, 1, height, width)
+    for i in range(0, len(tiles), batch_size):
+        chunk = tiles[i:i + batch_size]
+        batch = torch.cat([input[:, :, y:y + tile_size, x:x + tile_size] for y, x in chunk])
+        result = forward(batch)
+        if output is None:
+            output = input.new_zeros(n, result.size(1), height, width)
+        for j, (y, x) in enumerate(chunk):
+            output[:, :, y:y + tile_size, x:x + tile_size] += result[j * n:(j + 1) * n] * window
+            weight[:, :, y:y + tile_size, x:x + tile_size] += window
+    return (output / weight)[:, :, margin:margin + h, margin:margin + w]
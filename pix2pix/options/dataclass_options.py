@@ -0,0 +1,98 @@
+"""Build options objects in code, without argparse parsing or sys.argv.
+
+<BaseOptions.parse> reads the command line, so library code that needs an options object had to overwrite
+sys.argv, which is neither thread-safe nor cheap: every call builds the parser, imports the model and dataset
+modules and parses the arguments three times. Here, the option definitions of an options class (including the
+model- and dataset-specific ones) are turned into a dataclass once per (options class, model, dataset mode), and
+every configuration is built once and then copied:
+
+    from options.test_options import TestOptions
+    from options.dataclass_options import make_options
+
+    opt = make_options(TestOptions, model='pix2pix', name='facades_pix2pix', gpu_ids='-1')
+    model = create_model(opt)
+
+The result has the same attributes as <BaseOptions.parse> returns. Unlike <BaseOptions.parse>, it neither prints the
+options nor selects the CUDA device.
+"""
+import argparse
+import copy
+import dataclasses
+from threading import Lock
+from typing import Any
+import models
+import data
+
+_lock = Lock()
+_dataclasses = {}  # (options class, model, dataset_mode) -> dataclass
+_options = {}      # (options class, sorted option items) -> options object
+
+
+def options_dataclass(options_class, model=None, dataset_mode=None):
+    """Return a dataclass whose fields are the options of <options_class> with their default values
+
+    Parameters:
+        options_class       -- TrainOptions | TestOptions
+        model (str)         -- the model whose options are added; the default model of <options_class> if None
+        dataset_mode (str)  -- the dataset mode whose options are added; the default of the model if None
+    """
+    key = (options_class, model, dataset_mode)
+    with _lock:
+        if key not in _dataclasses:
+            _dataclasses[key] = _make_dataclass(options_class, model, dataset_mode)
+        return _dataclasses[key]
+
+
+def _make_dataclass(options_class, model, dataset_mode):
+    # the same steps as <BaseOptions.gather_options>, with the defaults instead of parsed arguments
+    options = options_class()
+    parser = options.initialize(argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter))
+    model = model or parser.get_default('model')
+    parser = models.get_option_setter(model)(parser, options.isTrain)
+    dataset_mode = dataset_mode or parser.get_default('dataset_mode')
+    parser = data.get_option_setter(dataset_mode)(parser, options.isTrain)
+
+    defaults = {action.dest: action.default for action in parser._actions if action.dest != 'help'}
+    defaults.update(model=model, dataset_mode=dataset_mode, isTrain=options.isTrain)
+    fields = [(name, Any, dataclasses.field(default=default)) for name, default in defaults.items()]
+    return dataclasses.make_dataclass(options_class.__name__ + 'Dataclass', fields)
+
+
+def make_options(options_class, **kwargs):
+    """Return an options object of <options_class> with the given options set and all other options at their defaults
+
+    Parameters:
+        options_class -- TrainOptions | TestOptions
+        kwargs        -- option values by name, e.g. name='facades_pix2pix', gpu_ids='-1'
+
+    Every call returns a new (shallow) copy, so callers may change the options they get.
+    """
+    try:
+        key = (options_class, tuple(sorted(kwargs.items())))
+        hash(key)
+    except TypeError:  # unhashable option values are not cached
+        key = None
+    with _lock:
+        opt = _options.get(key)
+    if opt is None:
+        opt = _build_options(options_class, kwargs)
+        if key is not None:
+            with _lock:
+                _options[key] = opt
+    return copy.copy(opt)
+
+
+def _build_options(options_class, kwargs):
+    cls = options_dataclass(options_class, kwargs.get('model'), kwargs.get('dataset_mode'))
+    names = {field.name for field in dataclasses.fields(cls)}
+    unknown = sorted(set(kwargs) - names)
+    if unknown:
+        raise ValueError('unknown options: %s' % ', '.join(unknown))
+    opt = cls(**{name: value for name, value in kwargs.items() if value is not None})
+
+    # the same post-processing as <BaseOptions.parse>
+    if opt.suffix:
+        opt.name = opt.name + '_' + opt.suffix.format(**vars(opt))
+    if isinstance(opt.gpu_ids, str):
+        opt.gpu_ids = [int(str_id) for str_id in opt.gpu_ids.split(',') if int(str_id) >= 0]
+    return opt
@@ -15,6 +15,17 @@ class TestOptions(BaseOptions):
         # Dropout and Batchnorm has different behavioir during training and test.
         parser.add_argument('--eval', action='store_true', help='use eval mode during test time.')
         parser.add_argument('--num_test', type=int, default=50, help='how many test images to run')
+        # reduced-precision CPU inference, see models/quantization.py
+        parser.add_argument('--quantize', type=str, default='none', help='quantize the networks for CPU inference: none | int8 | bf16. int8 needs --eval')
+        parser.add_argument('--calib_dir', type=str, default='', help='images to calibrate INT8 quantization and to measure the accuracy against float32')
+        parser.add_argument('--calib_size', type=int, default=8, help='how many calibration images to use')
+        parser.add_argument('--export_mode', type=str, default='trace', help='how export.py compiles the generator to TorchScript: trace | script')
+        parser.add_argument('--export_format', type=str, default='torchscript', help='what export.py writes: torchscript | onnx')
+        parser.add_argument('--onnx_opset', type=int, default=17, help='ONNX opset version of the export')
+        # fast inference, see models/compilation.py
+        parser.add_argument('--channels_last', action='store_true', help='run the networks in channels_last memory layout')
+        parser.add_argument('--compile', action='store_true', help='compile the networks with torch.compile for inputs of crop_size')
+        parser.add_argument('--compile_cache_dir', type=str, default='', help='keep the compiled kernels in this directory across runs')
         # rewrite devalue values
         parser.set_defaults(model='test')
         # To avoid cropping, the load_size should be the same as crop_size
@@ -0,0 +1,5 @@
+set -ex
+# convert the checkpoints of the five texgen map models to memory-mappable checkpoints for the backend
+for map in Albedo Normal Height Roughness Metallic; do
+    python convert_checkpoints.py --dataroot ./datasets/texgen --name texgen_p2p_$map --model pix2pix --checkpoints_dir ../checkpoints --load_size 1024 --crop_size 1024 --gpu_ids -1
+done
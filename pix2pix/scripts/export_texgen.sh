@@ -0,0 +1,5 @@
+set -ex
+# export the generators of the five texgen map models for the backend (MATGEN_TORCHSCRIPT=1)
+for map in Albedo Normal Height Roughness Metallic; do
+    python export.py --dataroot ./datasets/texgen --name texgen_p2p_$map --model pix2pix --checkpoints_dir ../checkpoints --load_size 1024 --crop_size 1024 --gpu_ids -1
+done
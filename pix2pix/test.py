@@ -67,6 +67,10 @@ if __name__ == '__main__':
     # For [CycleGAN]: It should not affect CycleGAN as CycleGAN uses instancenorm without dropout.
     if opt.eval:
         model.eval()
+    if opt.quantize != 'none':
+        model.quantize()  # prints the accuracy of the quantized networks on --calib_dir
+    if opt.channels_last or opt.compile:
+        model.compile()
     for i, data in enumerate(dataset):
         if i >= opt.num_test:  # only apply our model to opt.num_test images.
             break
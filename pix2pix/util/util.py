@@ -2,8 +2,11 @@
 from __future__ import print_function
 import torch
 import numpy as np
+from collections import OrderedDict
 from PIL import Image
 import os
+import struct
+import zlib
 
 
 def tensor2im(input_image, imtype=np.uint8):
@@ -11,22 +14,55 @@ def tensor2im(input_image, imtype=np.uint8):
 
     Parameters:
         input_image (tensor) --  the input image tensor array
-        imtype (type)        --  the desired type of the converted numpy array
+        imtype (type)        --  the desired type of the converted numpy array; np.uint16 scales to the full 16-bit range
+
+    Only the first image of a batch is converted; see <tensors2im> for whole batches.
     """
     if not isinstance(input_image, np.ndarray):
         if isinstance(input_image, torch.Tensor):  # get the data from a variable
-            image_tensor = input_image.data
+            return tensors2im(input_image.data[:1], imtype)[0]
         else:
             return input_image
-        image_numpy = image_tensor[0].cpu().float().numpy()  # convert it into a numpy array
-        if image_numpy.shape[0] == 1:  # grayscale to RGB
-            image_numpy = np.tile(image_numpy, (3, 1, 1))
-        image_numpy = (np.transpose(image_numpy, (1, 2, 0)) + 1) / 2.0 * 255.0  # post-processing: tranpose and scaling
     else:  # if it is a numpy array, do nothing
         image_numpy = input_image
     return image_numpy.astype(imtype)
 
 
+def tensors2im(input_images, imtype=np.uint8):
+    """Convert a batch of image tensors in [-1, 1] into a numpy array of images
+
+    Parameters:
+        input_images (tensor) -- NxCxHxW tensor (C = 1 or 3), on any device
+        imtype (type)         -- np.uint8 | np.uint16; np.uint16 scales to the full 16-bit range
+
+    Returns an NxHxWx3 array; grayscale images are repeated to RGB. The scaling, the transpose and (for uint8)
+    the cast run as torch operations on the device of the input, so only the final images are copied to the CPU.
+    The values are the same as those of <tensor2im>.
+    """
+    max_value = 65535.0 if imtype == np.uint16 else 255.0
+    images = input_images.detach().float()
+    if images.size(1) == 1:  # grayscale to RGB
+        images = images.expand(-1, 3, -1, -1)
+    images = images.permute(0, 2, 3, 1).add(1).div_(2.0).mul_(max_value)  # post-processing: tranpose and scaling
+    if imtype == np.uint8:
+        return images.to(torch.uint8).cpu().numpy()
+    return images.cpu().numpy().astype(imtype)  # torch has no general uint16 support
+
+
+def visuals2im(visuals, names=None, imtype=np.uint8):
+    """Convert the visuals of a model into numpy arrays of images, by name
+
+    Parameters:
+        visuals (OrderedDict) -- (name, NxCxHxW tensor) pairs, as returned by <BaseModel.get_current_visuals>
+        names (str list)      -- the visuals to convert; all if None
+        imtype (type)         -- np.uint8 | np.uint16
+
+    Returns an OrderedDict of (name, NxHxWx3 array) pairs, every batch converted at once (see <tensors2im>).
+    """
+    names = list(visuals) if names is None else names
+    return OrderedDict((name, tensors2im(visuals[name], imtype)) for name in names)
+
+
 def diagnose_network(net, name='network'):
     """Calculate and print the mean of average absolute(gradients)
 
@@ -64,6 +100,34 @@ def save_image(image_numpy, image_path, aspect_ratio=1.0):
     image_pil.save(image_path)
 
 
+def encode_png16(image_numpy, compress_level=6):
+    """Encode a 16-bit image as PNG and return the file contents
+
+    Parameters:
+        image_numpy (numpy array) -- HxW or HxWxC (C = 1 or 3) array of type np.uint16
+        compress_level (int)      -- zlib compression level, 0-9
+
+    PIL cannot write 16-bit RGB images, so the PNG chunks are assembled here. Every row uses the
+    'Sub' filter, which suits smooth material maps and is cheap to compute.
+    """
+    h, w = image_numpy.shape[:2]
+    c = 1 if image_numpy.ndim == 2 else image_numpy.shape[2]
+    color_type = {1: 0, 3: 2}[c]  # grayscale | RGB
+    bpp = 2 * c  # bytes per pixel
+    rows = np.ascontiguousarray(image_numpy, dtype='>u2').view(np.uint8).reshape(h, w * bpp)
+    raw = np.empty((h, 1 + w * bpp), dtype=np.uint8)
+    raw[:, 0] = 1  # filter type 'Sub'
+    raw[:, 1:1 + bpp] = rows[:, :bpp]
+    np.subtract(rows[:, bpp:], rows[:, :-bpp], out=raw[:, 1 + bpp:])  # wraps around modulo 256
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', w, h, 16, color_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)) + chunk(b'IEND', b''))
+
+
 def print_numpy(x, val=True, shp=False):
     """Print the mean, min, max, median, std, and size of a numpy array
 
@@ -0,0 +1,161 @@
+"""Content-addressed cache for generated map sets.
+
+A result set is looked up by <cache_key>, a hash of the decoded input image and of the identity of
+the models that produced it. Entries live in a memory tier bounded by size and, optionally, in an
+on-disk tier with its own size bound; both evict the least recently used entries first.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(image, model_id):
+    """Return the hex digest identifying the results of <image> (a PIL image) under the models <model_id>"""
+    h = hashlib.sha256()
+    h.update(model_id.encode('utf-8'))
+    h.update(('%s %d %d' % (image.mode, *image.size)).encode('utf-8'))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def result_size(result):
+    return sum(len(value) for value in result.values())
+
+
+class ResultCache:
+    """LRU cache of {map name: encoded image} dicts with a memory tier and an optional disk tier"""
+
+    def __init__(self, max_bytes, disk_dir=None, max_disk_bytes=0):
+        """
+        Parameters:
+            max_bytes (int)      -- size bound of the memory tier; 0 disables it
+            disk_dir (str)       -- directory of the disk tier
+            max_disk_bytes (int) -- size bound of the disk tier; 0 disables it
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir if max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = Lock()
+        self.memory = OrderedDict()  # key -> result, least recently used first
+        self.memory_bytes = 0
+        self.disk = OrderedDict()    # key -> file size, least recently used first
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir is not None:
+            self._scan_disk()
+
+    def _scan_disk(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.pkl'):
+                st = os.stat(os.path.join(self.disk_dir, name))
+                entries.append((st.st_mtime, name[:-len('.pkl')], st.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+        self._evict_disk()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + '.pkl')
+
+    def get(self, key):
+        """Return the cached result for <key>, or None"""
+        with self.lock:
+            result = self.memory.get(key)
+            if result is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return result
+            if key not in self.disk:
+                self.misses += 1
+                return None
+            self.disk.move_to_end(key)
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                result = pickle.load(f)
+            os.utime(self._path(key))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logger.warning(f"Dropping unreadable cache entry {key}")
+            with self.lock:
+                self._drop_disk(key)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_memory(key, result)
+        return result
+
+    def put(self, key, result):
+        """Store a result in both tiers, evicting least recently used entries as needed"""
+        with self.lock:
+            self._put_memory(key, result)
+            if self.disk_dir is None or key in self.disk:
+                return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            logger.exception(f"Could not write cache entry {key}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self.lock:
+            if key not in self.disk:
+                self.disk[key] = size
+                self.disk_bytes += size
+            self._evict_disk()
+
+    def _put_memory(self, key, result):
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= result_size(self.memory.pop(key))
+        self.memory[key] = result
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= result_size(evicted)
+
+    def _drop_disk(self, key):
+        size = self.disk.pop(key, None)
+        if size is None:
+            return
+        self.disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and self.disk:
+            self._drop_disk(next(iter(self.disk)))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_bytes,
+                'disk_entries': len(self.disk),
+                'disk_bytes': self.disk_bytes,
+            }